@@ -1,22 +1,35 @@
 from __future__ import unicode_literals
 
 import datetime
+import pickle
 import sys
+import time
 import xapian
 import subprocess
 import os
+import shutil
 
 from django.db import models
 from django.test import TestCase
 
 from haystack import connections
 from haystack import indexes
-from haystack.backends.xapian_backend import InvalidIndexError, _term_to_xapian_value
+from haystack.backends.xapian_backend import InvalidIndexError, XapianSearchBackend, XHCompactCodec, \
+    XHEdgeNgramField, XHFacetCount, XHHighlighter, XHLRUCache, XHNgramField, XHPickleCodec, LEGACY_VALUE_ENCODING, \
+    MULTI_VALUE_SLOT_START, MULTI_VALUE_SLOTS, SORTABLE_VALUE_ENCODING, STORED_FIELDS_METADATA_KEY, _exact_term, \
+    _from_xapian_value, _get_django_cache, _prefix_terms, _term_to_xapian_value
+from haystack.exceptions import FacetingError
+from haystack.models import SearchResult
+from haystack.query import SQ
+from haystack.utils import get_identifier
 from haystack.utils.loading import UnifiedIndex
 
 from core.models import MockTag, MockModel, AnotherMockModel
 from mocks import MockSearchResult
 
+# caches keyed by the database revision are disabled without it (Xapian < 1.4)
+HAS_REVISIONS = hasattr(xapian.Database, 'get_revision')
+
 
 def get_terms(backend, *args):
     result = subprocess.check_output(['delve'] + list(args) + [backend.path],
@@ -173,6 +186,15 @@ class XapianEdgeNGramIndex(indexes.SearchIndex):
         return XapianMockModel
 
 
+class XapianNGramLengthsIndex(indexes.SearchIndex):
+    text = indexes.CharField(model_attr='author', document=True)
+    ngram = XHNgramField(model_attr='author', ngram_min_length=3, ngram_max_length=4)
+    edge_ngram = XHEdgeNgramField(model_attr='author', ngram_max_length=3)
+
+    def get_model(self):
+        return XapianMockModel
+
+
 class HaystackBackendTestCase(object):
     """
     Abstract TestCase that implements an hack to ensure `connections`
@@ -403,6 +425,35 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.backend.update(self.index, self.sample_objs)
         self.assertEqual(self.backend.document_count(), 3)
 
+    def test_update_in_batches(self):
+        old_batch_commit_size = self.backend.batch_commit_size
+        self.backend.batch_commit_size = 2
+        try:
+            self.backend.clear()
+            self.backend.update(self.index, self.sample_objs)
+            self.assertEqual(self.backend.document_count(), 3)
+        finally:
+            self.backend.batch_commit_size = old_batch_commit_size
+
+    def test_update_undecodable_object(self):
+        class UndecodableIndex(XapianMockSearchIndex):
+            def prepare_month(self, obj):
+                if obj.id == 2:
+                    raise UnicodeDecodeError(str('utf-8'), b'\xff', 0, 1, str('invalid start byte'))
+                return super(UndecodableIndex, self).prepare_month(obj)
+
+        self.backend.clear()
+        # only the object is skipped
+        self.backend.update(UndecodableIndex(), self.sample_objs)
+        self.assertEqual(pks(self.backend.search(xapian.Query(''))['results']), [1, 3])
+
+        self.backend.silently_fail = False
+        try:
+            self.backend.clear()
+            self.assertRaises(UnicodeDecodeError, self.backend.update, UndecodableIndex(), self.sample_objs)
+        finally:
+            self.backend.silently_fail = True
+
     def test_remove(self):
         self.backend.remove(self.sample_objs[0])
         self.assertEqual(pks(self.backend.search(xapian.Query(''))['results']),
@@ -427,6 +478,95 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.backend.clear([AnotherMockModel, XapianMockModel])
         self.assertEqual(self.backend.document_count(), 0)
 
+    def test_reader_pool(self):
+        self.backend.search(xapian.Query(''))
+        stats = self.backend.reader_pool.stats()
+
+        self.backend.search(xapian.Query(''))
+        self.assertEqual(self.backend.reader_pool.stats()['misses'], stats['misses'])
+        self.assertTrue(self.backend.reader_pool.stats()['hits'] > stats['hits'])
+
+        self.backend.update(self.index, self.sample_objs)
+        self.assertEqual(pks(self.backend.search(xapian.Query(''))['results']), [1, 2, 3])
+        self.assertEqual(self.backend.reader_pool.stats()['reopens'], stats['reopens'] + 1)
+
+        # the pool is shared by the backends of the path: their writes are seen at once
+        other = self.backend.__class__('default', **connections['default'].options)
+        self.assertTrue(other.reader_pool is self.backend.reader_pool)
+        other.remove(self.sample_objs[0])
+        self.assertEqual(pks(self.backend.search(xapian.Query(''))['results']), [2, 3])
+
+        self.backend.clear()
+        self.assertEqual(self.backend.document_count(), 0)
+
+    def test_staged_rebuild(self):
+        self.backend.staged_rebuild = True
+        try:
+            self.backend.clear()
+            # readers still see the published database
+            self.assertEqual(self.backend.document_count(), 3)
+
+            self.backend.update(self.index, self.sample_objs[:1])
+            self.assertEqual(self.backend.document_count(), 3)
+
+            # other writes go to the published database
+            self.backend.remove(self.sample_objs[2])
+            self.assertEqual(self.backend.document_count(), 2)
+
+            self.assertTrue(self.backend.publish())
+            self.assertEqual(self.backend.document_count(), 1)
+            self.assertFalse(self.backend.publish())
+
+            # a staging database left by another thread does not capture updates
+            self.backend.clear()
+            rebuild = self.backend._local.staging
+            self.backend._local.staging = None
+            self.backend.update(self.index, self.sample_objs)
+            self.assertEqual(self.backend.document_count(), 3)
+            # nor is it published by this thread
+            self.assertFalse(self.backend.publish())
+
+            # a rebuild without updates is not published
+            self.backend._local.staging = rebuild
+            self.assertRaises(InvalidIndexError, self.backend.publish)
+            self.assertEqual(self.backend.document_count(), 3)
+
+            # a rebuild whose update failed is not published either
+            self.backend.clear()
+            self.backend.update(self.index, self.sample_objs[:1])
+            self.assertRaises(AttributeError, self.backend.update, self.index, [None])
+            self.assertRaises(InvalidIndexError, self.backend.publish)
+            self.assertEqual(self.backend.document_count(), 3)
+
+            # the next rebuild discards the staging database that was not published
+            self.backend.clear()
+            self.backend.update(self.index, self.sample_objs[:2])
+            self.assertTrue(self.backend.publish())
+            self.assertEqual(self.backend.document_count(), 2)
+        finally:
+            self.backend.staged_rebuild = False
+            self.backend._local.staging = None
+            shutil.rmtree(self.backend._staging_path(), ignore_errors=True)
+
+    def test_publish_compacted_shards(self):
+        shards = [self.backend._sibling_path('shard') for i in range(2)]
+        try:
+            for shard, objs in zip(shards, (self.sample_objs[:2], self.sample_objs[2:])):
+                options = dict(connections['default'].options, PATH=shard)
+                self.backend.__class__('default', **options).update(self.index, objs)
+
+            destination = self.backend._sibling_path('rebuild')
+            self.backend._compact(shards, destination)
+        finally:
+            for shard in shards:
+                shutil.rmtree(shard)
+
+        self.backend._publish(destination)
+        self.assertTrue(os.path.islink(self.backend.path))
+        self.assertEqual(self.backend.document_count(), 3)
+        self.assertEqual(pks(self.backend.search(xapian.Query(''))['results']),
+                         [1, 2, 3])
+
     def test_search(self):
         # no match query
         self.assertEqual(self.backend.search(xapian.Query()), {'hits': 0, 'results': []})
@@ -438,6 +578,227 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.assertTrue(isinstance(self.backend.search(xapian.Query('indexed'),
                                                        result_class=MockSearchResult)['results'][0], MockSearchResult))
 
+    def test_hit_count_modes(self):
+        results = self.backend.search(xapian.Query('indexed'))
+        self.assertEqual(results['hits'], 3)
+        self.assertEqual(results['hits_bounds'], (3, 3))
+
+        old_mode = self.backend.hit_count_mode
+        try:
+            for mode in ('estimated', 'bounded'):
+                self.backend.hit_count_mode = mode
+                results = self.backend.search(xapian.Query('indexed'), end_offset=1)
+                self.assertEqual(results['hits'], 3)
+                self.assertEqual(len(results['results']), 1)
+
+            # 'exact' counts are not traded for faster facets
+            self.backend.hit_count_mode = 'exact'
+            self.backend.facet_check_at_least = 1
+            results = self.backend.search(xapian.Query('indexed'), end_offset=1, facets=['name'])
+            self.assertEqual(results['hits'], 3)
+            self.assertEqual(results['hits_bounds'], (3, 3))
+        finally:
+            self.backend.hit_count_mode = old_mode
+            self.backend.facet_check_at_least = None
+
+    def test_count(self):
+        self.assertEqual(self.backend.count(xapian.Query()), 0)
+        self.assertEqual(self.backend.count(xapian.Query('indexed')), 3)
+        self.assertEqual(self.backend.count(xapian.Query('indexed'), narrow_queries=['name:david1']), 1)
+
+        self.backend.count_cache.clear()
+        self.backend.count(xapian.Query('indexed'))
+        self.assertEqual(self.backend.count_cache.stats()['size'], 1 if HAS_REVISIONS else 0)
+        self.backend.remove(self.sample_objs[0])
+        self.assertEqual(self.backend.count(xapian.Query('indexed')), 2)
+
+    def test_lazy_results(self):
+        old_window_size = self.backend.results_window_size
+        old_staleness = self.backend.reader_pool.staleness
+        self.backend.results_window_size = 2
+        try:
+            results = self.backend.search(xapian.Query(''))['results']
+            self.assertEqual(len(results), 3)
+            self.assertEqual(pks(results), [1, 2, 3])
+            self.assertEqual(results[2].pk, 3)
+            self.assertEqual(results[-1].pk, 3)
+            self.assertEqual(pks(results[1:]), [2, 3])
+            self.assertRaises(IndexError, lambda: results[3])
+
+            # stepped slices only fetch the windows of their positions
+            results = self.backend.search(xapian.Query(''))['results']
+            fetched = []
+            fetch = results._fetch
+            results._fetch = lambda start, count: fetched.append(count) or fetch(start, count)
+            self.assertEqual(pks(results[::2]), [1, 3])
+            self.assertEqual(pks(results[::-2]), [3, 1])
+            self.assertEqual(set(fetched), set([2]))
+
+            results = self.backend.search(xapian.Query(''), start_offset=1)['results']
+            self.assertEqual(pks(results), [2, 3])
+
+            # the results read the pooled database of the thread,
+            # which is reused while it is up to date...
+            self.backend.reader_pool.staleness = 60
+            results = self.backend.search(xapian.Query(''))['results']
+            misses = self.backend.reader_pool.stats()['misses']
+            self.assertEqual(pks(self.backend.search(xapian.Query(''))['results']), [1, 2, 3])
+            self.assertEqual(self.backend.reader_pool.stats()['misses'], misses)
+
+            # ...but not reopened: they keep reading the revision they were searched on
+            self.backend.remove(self.sample_objs[0])
+            self.assertEqual(pks(self.backend.search(xapian.Query(''))['results']), [2, 3])
+            self.assertEqual(self.backend.reader_pool.stats()['misses'], misses + 1)
+            self.assertEqual(len(results), 3)
+            self.assertEqual(pks(results), [1, 2, 3])
+        finally:
+            self.backend.results_window_size = old_window_size
+            self.backend.reader_pool.staleness = old_staleness
+
+    def test_lazy_decoding(self):
+        result = self.backend.search(xapian.Query('indexed'), end_offset=1)['results'][0]
+        self.assertFalse('name' in result.__dict__)
+        self.assertEqual(result.name, 'david1')
+        self.assertEqual(result.pk, 1)
+
+        result = pickle.loads(pickle.dumps(
+            self.backend.search(xapian.Query('indexed'), end_offset=1)['results'][0]))
+        self.assertEqual(type(result), SearchResult)
+        self.assertEqual(result.name, 'david1')
+
+    def test_compact_codec(self):
+        codec = XHCompactCodec('zlib')
+        data = {'name': 'david1', 'value': -5, 'flag': True, 'sites': ['1', '2'],
+                'pub_date': datetime.datetime(2009, 2, 25, 1, 1, 1), 'month': datetime.date(2009, 2, 1),
+                'popularity': 834.0, 'empty': None}
+        encoded = codec.encode('xapian_tests', 'xapianmockmodel', 1, data)
+        self.assertEqual(codec.decode(encoded), ('xapian_tests', 'xapianmockmodel', 1, data))
+        self.assertEqual(codec.decode(encoded, set(['name'])),
+                         ('xapian_tests', 'xapianmockmodel', 1, {'name': 'david1'}))
+
+        # both codecs read the data written by the other
+        self.assertEqual(XHPickleCodec().decode(encoded)[3], data)
+        self.assertEqual(codec.decode(XHPickleCodec().encode('a', 'b', 1, data))[3], data)
+
+        # with a schema, fields are written by number and read back through its fingerprint
+        schema = self.backend._update_cache()
+        self.assertTrue('month' in schema.stored_field_names)
+        encoded = XHCompactCodec().encode('xapian_tests', 'xapianmockmodel', 1, data, schema)
+        self.assertFalse(b'popularity' in encoded)
+        self.assertRaises(InvalidIndexError, codec.decode, encoded)
+        get_field_names = self.backend._get_stored_field_names(self.backend._database())
+        self.assertEqual(codec.decode(encoded, None, get_field_names), ('xapian_tests', 'xapianmockmodel', 1, data))
+        self.assertEqual(codec.decode(codec.encode('a', 'b', 1, {'other': 1}, schema), None, get_field_names)[3],
+                         {'other': 1})
+
+        old_codec = self.backend.codec
+        self.backend.codec = codec
+        try:
+            self.backend.update(self.index, self.sample_objs)
+            result = self.backend.search(xapian.Query('indexed'), end_offset=1)['results'][0]
+            self.assertEqual(result.name, 'david1')
+            self.assertEqual(result.pk, 1)
+            metadata = self.backend._database().get_metadata(STORED_FIELDS_METADATA_KEY % schema.fingerprint)
+            self.assertEqual(metadata.decode('utf-8') if isinstance(metadata, bytes) else metadata,
+                             '\n'.join(schema.stored_field_names))
+        finally:
+            self.backend.codec = old_codec
+
+    def test_result_cache(self):
+        old_cache = self.backend.result_cache
+        self.backend.result_cache = XHLRUCache(2)
+        try:
+            # replacing a document in place, with the same length, changes the response
+            self.backend.search(xapian.Query('indexed'), end_offset=2)
+            self.sample_objs[0].author = 'david9'
+            self.backend.update(self.index, self.sample_objs[:1])
+            self.assertEqual(self.backend.search(xapian.Query('indexed'), end_offset=2)['results'][0].name,
+                             'david9')
+            self.sample_objs[0].author = 'david1'
+            self.backend.update(self.index, self.sample_objs[:1])
+
+            if not HAS_REVISIONS:
+                self.assertEqual(len(self.backend.result_cache), 0)
+                return
+
+            self.backend.result_cache = XHLRUCache(2)
+            results = self.backend.search(xapian.Query('indexed'), end_offset=2, facets=['name'])
+            cached = self.backend.search(xapian.Query('indexed'), end_offset=2, facets=['name'])
+            self.assertEqual(self.backend.result_cache.stats()['hits'], 1)
+            self.assertEqual(pks(cached['results']), pks(results['results']))
+            self.assertEqual(cached['facets'], results['facets'])
+
+            # each hit gets its own results and facets
+            cached['results'][0].name = 'changed'
+            cached['facets']['fields']['name'].append(('changed', 1))
+            cached = self.backend.search(xapian.Query('indexed'), end_offset=2, facets=['name'])
+            self.assertTrue(cached['results'][0] is not results['results'][0])
+            self.assertEqual(cached['results'][0].name, 'david1')
+            self.assertEqual(cached['facets'], results['facets'])
+            self.assertEqual(self.backend.result_cache.stats()['hits'], 2)
+
+            # a different query is a different entry
+            self.backend.search(xapian.Query('indexed'), end_offset=1)
+            self.assertEqual(self.backend.result_cache.stats()['misses'], 2)
+
+            # a commit changes the revision
+            self.backend.remove(self.sample_objs[0])
+            self.assertEqual(pks(self.backend.search(xapian.Query('indexed'), end_offset=2)['results']),
+                             [2, 3])
+            self.assertEqual(self.backend.result_cache.stats()['evictions'], 1)
+
+            # lazy results are not cached
+            self.backend.search(xapian.Query('indexed'))
+            self.assertEqual(self.backend.result_cache.stats()['misses'], 3)
+        finally:
+            self.backend.result_cache = old_cache
+
+    def test_result_cache_alias(self):
+        if not HAS_REVISIONS:
+            return
+        cache = _get_django_cache('default')
+        cache.clear()
+        options = dict(connections['default'].options, RESULT_CACHE_ALIAS='default', RESULT_CACHE_TIMEOUT=60)
+        backend = self.backend.__class__('default', **options)
+        self.assertTrue(backend.result_cache is None)
+
+        response = backend.search(xapian.Query('indexed'), end_offset=2)
+        cached = backend.search(xapian.Query('indexed'), end_offset=2)
+        self.assertEqual(pks(cached['results']), pks(response['results']))
+
+        # the Django cache keeps the response for `RESULT_CACHE_TIMEOUT` seconds
+        expires = [expires for key, expires in cache._expire_info.items() if 'xapian:' in key]
+        self.assertEqual(len(expires), 1)
+        self.assertTrue(time.time() < expires[0] <= time.time() + 60)
+        cache.clear()
+
+    def test_query_parser_reuse(self):
+        self.backend.parse_query('indexed')
+        query_parser = self.backend._local.query_parser
+        self.assertEqual(str(self.backend.parse_query('name:david')),
+                         'Xapian::Query(ZXNAMEdavid:(pos=1))')
+        self.assertTrue(self.backend._local.query_parser is query_parser)
+
+        old_size = self.backend.query_cache_size
+        self.backend.query_cache_size = 10
+        try:
+            query = self.backend.parse_query('indexed')
+            self.assertEqual(self.backend.parse_query('indexed') is query, HAS_REVISIONS)
+            if HAS_REVISIONS:
+                self.assertEqual(self.backend._local.query_cache.stats()['hits'], 1)
+
+            # a commit changes the revision
+            self.backend.remove(self.sample_objs[0])
+            self.assertFalse(self.backend.parse_query('indexed') is query)
+        finally:
+            self.backend.query_cache_size = old_size
+            self.backend._local.query_cache = None
+
+    def test_search_fields(self):
+        result = self.backend.search(xapian.Query('indexed'), fields=['name'], end_offset=1)['results'][0]
+        self.assertEqual(result.name, 'david1')
+        self.assertEqual(result.month, None)
+
     def test_search_field_with_punctuation(self):
         self.assertEqual(pks(self.backend.search(xapian.Query('http://example.com/1/'))['results']),
                          [1])
@@ -467,6 +828,33 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.assertEqual(results['facets']['fields']['sites'],
                          [('1', 1), ('3', 2), ('2', 2), ('4', 1), ('6', 2), ('9', 1)])
 
+        # multi valued facets count the whole match, not only the returned results
+        results = self.backend.search(xapian.Query('indexed'), end_offset=1, facets=['sites'])
+        self.assertEqual(len(results['results']), 1)
+        self.assertEqual(sorted(results['facets']['fields']['sites']),
+                         [('1', 1), ('2', 2), ('3', 2), ('4', 1), ('6', 2), ('9', 1)])
+
+        # and return the original values
+        results = self.backend.search(xapian.Query('indexed'), facets=['keys'])
+        self.assertEqual(sorted(results['facets']['fields']['keys']),
+                         [(1, 1), (2, 2), (3, 2), (4, 1), (6, 2), (9, 1)])
+
+        # only the multi valued fields of MULTI_VALUE_FACET_FIELDS store their values in slots
+        self.backend.multi_value_facet_fields = frozenset(['sites'])
+        self.backend._fields = None  # rebuilds the schema
+        try:
+            self.backend.clear()
+            self.backend.update(self.index, self.sample_objs)
+            slot = MULTI_VALUE_SLOT_START + self.backend.column['keys'] * MULTI_VALUE_SLOTS
+            self.assertEqual(self.backend._database().get_value_freq(slot), 0)
+            self.assertRaises(FacetingError, self.backend.search, xapian.Query('indexed'), facets=['keys'])
+            results = self.backend.search(xapian.Query('indexed'), facets=['sites'])
+            self.assertEqual(sorted(results['facets']['fields']['sites']),
+                             [('1', 1), ('2', 2), ('3', 2), ('4', 1), ('6', 2), ('9', 1)])
+        finally:
+            self.backend.multi_value_facet_fields = None
+            self.backend._fields = None
+
     def test_raise_index_error_on_wrong_field(self):
         """
         Regression test for #109.
@@ -503,6 +891,36 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
             ('2009-02-01T00:00:00', 0)
         ])
 
+    def test_date_facets_legacy_encoding(self):
+        facets = {'pub_date': {'start_date': datetime.datetime(2009, 1, 1),
+                               'end_date': datetime.datetime(2009, 3, 1),
+                               'gap_by': 'month'}}
+        class Spy(object):
+            def __init__(self, term):
+                self.term = term
+
+            def values(self):
+                return [XHFacetCount(self.term, 2)]
+
+        # spies return the values as bytes on Python 3 and as text on Python 2
+        for term in (b'20090215000000', '20090215000000'):
+            spy = Spy(term)
+            self.assertEqual(XapianSearchBackend._do_date_facets([spy], facets, LEGACY_VALUE_ENCODING),
+                             {'pub_date': [('2009-02-01T00:00:00', 2), ('2009-01-01T00:00:00', 0)]})
+
+    def test_date_facets_count_whole_match(self):
+        facets = {'pub_date': {'start_date': datetime.date(2008, 11, 1),
+                               'end_date': datetime.date(2009, 4, 1),
+                               'gap_by': 'month',
+                               'gap_amount': 2}}
+        results = self.backend.search(xapian.Query('indexed'), end_offset=1, date_facets=facets)
+        self.assertEqual(len(results['results']), 1)
+        self.assertEqual(results['facets']['dates']['pub_date'], [
+            ('2009-03-01', 0),
+            ('2009-01-01', 3),
+            ('2008-11-01', 0),
+        ])
+
     def test_query_facets(self):
         self.assertEqual(self.backend.search(xapian.Query(), query_facets={'name': 'da*'}),
                          {'hits': 0, 'results': []})
@@ -511,6 +929,25 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.assertEqual(results['hits'], 3)
         self.assertEqual(results['facets']['queries']['name'], ('da*', 3))
 
+    def test_query_facets_narrowed_by_query(self):
+        results = self.backend.search(self.backend.parse_query('name:david1'),
+                                      query_facets={'name': 'da*', 'text': 'indexed'})
+        self.assertEqual(results['hits'], 1)
+        self.assertEqual(results['facets']['queries'], {'name': ('da*', 1), 'text': ('indexed', 1)})
+
+        old_threads = self.backend.query_facet_threads
+        self.backend.query_facet_threads = 2
+        try:
+            results = self.backend.search(xapian.Query('indexed'),
+                                          query_facets={'name': 'david1', 'text': 'indexed'})
+            self.assertEqual(results['facets']['queries'], {'name': ('david1', 1), 'text': ('indexed', 3)})
+            # backends share the pool
+            other = self.backend.__class__('default', **dict(connections['default'].options,
+                                                             QUERY_FACET_THREADS=2))
+            self.assertTrue(self.backend._get_query_facet_pool() is other._get_query_facet_pool())
+        finally:
+            self.backend.query_facet_threads = old_threads
+
     def test_narrow_queries(self):
         self.assertEqual(self.backend.search(xapian.Query(), narrow_queries={'name:david1'}),
                          {'hits': 0, 'results': []})
@@ -526,6 +963,27 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.assertEqual([result.highlighted['text'] for result in results],
                          ['<em>indexed</em>!\n1', '<em>indexed</em>!\n2', '<em>indexed</em>!\n3'])
 
+    def test_highlighter(self):
+        highlighter = XHHighlighter(self.backend.parse_query('index david1'))
+        self.assertEqual(highlighter.highlight('Indexing David1 and david2'),
+                         '<em>indexing</em> <em>david1</em> and david2')
+        self.assertEqual(highlighter.highlight(''), '')
+
+        # prefixes are stripped by matching the known ones, not upper case letters
+        query = xapian.Query(xapian.Query.OP_OR, ['XFIRST_NAMEdavid', 'ZXFIRST_NAMEholland', 'DNA'])
+        highlighter = XHHighlighter(query, prefixes=['XFIRST_NAME'])
+        self.assertEqual(highlighter.highlight('David Hollands and DNA'),
+                         '<em>david</em> <em>hollands</em> and <em>dna</em>')
+
+        if xapian.minor_version() >= 4:
+            old_length = self.backend.highlight_snippet_length
+            self.backend.highlight_snippet_length = 50
+            try:
+                results = self.backend.search(xapian.Query('indexed'), highlight=True)['results']
+                self.assertTrue('<em>Indexed</em>' in results[0].highlighted['text'])
+            finally:
+                self.backend.highlight_snippet_length = old_length
+
     def test_spelling_suggestion(self):
         self.assertEqual(self.backend.search(xapian.Query('indxe'))['hits'], 0)
         self.assertEqual(self.backend.search(xapian.Query('indxe'))['spelling_suggestion'],
@@ -543,6 +1001,21 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.assertEqual(self.backend.search(xapian.Query('XNAMEdavid'))['spelling_suggestion'],
                          'david1')
 
+    def test_spelling_suggestion_cache(self):
+        self.backend.spelling_cache.clear()
+        self.assertEqual(self.backend.search(xapian.Query('foo'), spelling_query='indxe indexy indxe')
+                         ['spelling_suggestion'], 'indexed indexed indexed')
+        self.assertEqual(self.backend.spelling_cache.stats()['size'], 2 if HAS_REVISIONS else 0)
+
+        old_max_hits = self.backend.spelling_max_hits
+        self.backend.spelling_max_hits = 2
+        try:
+            self.assertEqual(self.backend.search(xapian.Query('indexed'), spelling_query='indxe')
+                             ['spelling_suggestion'], '')
+            self.assertEqual(self.backend.search(xapian.Query('indxe'))['spelling_suggestion'], 'indexed')
+        finally:
+            self.backend.spelling_max_hits = old_max_hits
+
     def test_more_like_this(self):
         results = self.backend.more_like_this(self.sample_objs[0])
 
@@ -563,6 +1036,36 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
                                                                result_class=MockSearchResult)['results'][0],
                                    MockSearchResult))
 
+        # the identifiers of the document are not similar terms
+        terms = self.backend._get_similar_terms(self.backend._database(), get_identifier(self.sample_objs[0]))
+        self.assertFalse([term for term in terms if term[:1] in ('Q', b'Q')])
+
+        old_max_documents = self.backend.mlt_max_documents
+        self.backend.mlt_max_documents = 1
+        try:
+            results = self.backend.more_like_this(self.sample_objs[0])
+            self.assertEqual(pks(results['results']), [3])
+            self.assertEqual(results['hits'], 1)
+            self.assertEqual(pks(self.backend.more_like_this(self.sample_objs[0], start_offset=1)['results']), [])
+        finally:
+            self.backend.mlt_max_documents = old_max_documents
+
+    def test_more_like_this_cache(self):
+        old_cache, old_max_terms = self.backend.mlt_cache, self.backend.mlt_max_terms
+        self.backend.mlt_cache = XHLRUCache(10)
+        self.backend.mlt_max_terms = 5
+        try:
+            results = self.backend.more_like_this(self.sample_objs[0])
+            self.assertEqual(pks(self.backend.more_like_this(self.sample_objs[0])['results']),
+                             pks(results['results']))
+            self.assertEqual(self.backend.mlt_cache.stats()['hits'], 1 if HAS_REVISIONS else 0)
+            identifier = get_identifier(self.sample_objs[0])
+            self.assertTrue(len(self.backend._get_similar_terms(self.backend._database(), identifier)) <= 5)
+            self.assertEqual(self.backend._get_similar_terms(self.backend._database(), identifier + '0'),
+                             None)
+        finally:
+            self.backend.mlt_cache, self.backend.mlt_max_terms = old_cache, old_max_terms
+
     def test_order_by(self):
         results = self.backend.search(xapian.Query(''), sort_by=['pub_date'])
         self.assertEqual(pks(results['results']), [3, 2, 1])
@@ -600,6 +1103,18 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         results = self.backend.search(xapian.Query(''), sort_by=['flag', '-id'])
         self.assertEqual(pks(results['results']), [2, 3, 1])
 
+    def test_boolean_query(self):
+        # unranked results are in document id order, unless sorted
+        results = self.backend.search(xapian.Query(''), boolean_query=True)
+        self.assertEqual(pks(results['results']), [1, 2, 3])
+
+        results = self.backend.search(xapian.Query(''), sort_by=['-id'], boolean_query=True)
+        self.assertEqual(pks(results['results']), [3, 2, 1])
+
+        # narrow queries only restrict the matches
+        results = self.backend.search(xapian.Query('indexed'), narrow_queries=['name:david2'])
+        self.assertEqual(pks(results['results']), [2])
+
     def test_verify_type(self):
         self.assertEqual([result.month for result in self.backend.search(xapian.Query(''))['results']],
                          ['02', '02', '02'])
@@ -620,6 +1135,150 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
         self.assertEqual(_term_to_xapian_value(datetime.datetime(1899, 5, 18, 0, 0), 'date'),
                          '18990518000000')
 
+    def test_value_encoding(self):
+        self.assertEqual(_term_to_xapian_value(-5, 'integer', SORTABLE_VALUE_ENCODING),
+                         xapian.sortable_serialise(-5))
+        value = _term_to_xapian_value(datetime.datetime(1899, 5, 18, 1, 2, 3), 'datetime', SORTABLE_VALUE_ENCODING)
+        self.assertEqual(value, xapian.sortable_serialise(18990518010203))
+        self.assertEqual(_from_xapian_value(value, 'datetime', SORTABLE_VALUE_ENCODING),
+                         datetime.datetime(1899, 5, 18, 1, 2, 3))
+
+        self.backend.value_encoding = SORTABLE_VALUE_ENCODING
+        try:
+            # the index was built with the other encoding
+            self.assertRaises(InvalidIndexError, self.backend.update, self.index, self.sample_objs)
+            self.assertRaises(InvalidIndexError, self.backend.search, xapian.Query(''))
+            # the failed update released its lock
+            xapian.WritableDatabase(self.backend.path, xapian.DB_OPEN).close()
+
+            self.backend.clear()
+            self.backend.update(self.index, self.sample_objs)
+
+            results = self.backend.search(xapian.Query(''), sort_by=['-value'])
+            self.assertEqual(pks(results['results']), [3, 2, 1])
+            results = self.backend.search(xapian.Query(''), sort_by=['pub_date'])
+            self.assertEqual(pks(results['results']), [3, 2, 1])
+            results = self.backend.search(self.backend.parse_query('value:10..*'))
+            self.assertEqual(pks(results['results']), [2, 3])
+            results = self.backend.search(self.backend.parse_query('pub_date:2009-02-23..2009-02-24'))
+            self.assertEqual(pks(results['results']), [1, 2])
+            results = self.backend.search(self.backend.parse_query('pub_date:20090223..*'))
+            self.assertEqual(pks(results['results']), [1, 2])
+            # ranges of invalid dates are left to the query parser
+            self.assertRaises(xapian.QueryParserError, self.backend.parse_query, 'pub_date:2009..later')
+            results = self.backend.search(xapian.Query(''), facets=['value'])
+            self.assertEqual(results['facets']['fields']['value'], [(5, 1), (10, 1), (15, 1)])
+
+            # the values of the private fields keep the legacy encoding
+            query = connections['default'].get_query()
+            query.backend = self.backend
+            query.add_filter(SQ(django_id__gte=2))
+            self.assertEqual(pks(self.backend.search(query.build_query())['results']), [2, 3])
+            query = connections['default'].get_query()
+            query.backend = self.backend
+            query.add_filter(SQ(django_id__lt=2))
+            self.assertEqual(pks(self.backend.search(query.build_query())['results']), [1])
+            results = self.backend.search(self.backend.parse_query('django_id:2..3'))
+            self.assertEqual(pks(results['results']), [2, 3])
+            results = self.backend.search(xapian.Query(''), facets=['django_id'])
+            self.assertEqual(sorted(results['facets']['fields']['django_id']), [(1, 1), (2, 1), (3, 1)])
+        finally:
+            self.backend.value_encoding = LEGACY_VALUE_ENCODING
+
+    def test_exact_fields(self):
+        self.assertEqual(_exact_term('XNAME', ' David  Holland'), 'XENAME:david holland')
+        self.assertEqual(len(_exact_term('XNAME', 'a' * 300)), len('XENAME:') + 40)
+
+        old_exact_fields = self.backend.exact_fields
+        self.backend.exact_fields = frozenset(['name', 'sites'])
+        self.backend._fields = None  # rebuilds the schema
+        try:
+            self.backend.update(self.index, self.sample_objs)
+            terms = get_terms(self.backend, '-a')
+            self.assertTrue('XENAME:david1' in terms)
+            self.assertTrue('XESITES:1' in terms)
+            # the exact term replaces the terms marking the beginning and end of exact phrases
+            self.assertFalse('XNAME^' in terms)
+            self.assertFalse('XSITES$' in terms)
+
+            query = connections['default'].get_query()
+            query.backend = self.backend
+            query.add_filter(SQ(name__exact='David1'))
+            self.assertEqual(str(query.build_query()), 'Xapian::Query(XENAME:david1)')
+            self.assertEqual(pks(self.backend.search(query.build_query())['results']), [1])
+
+            query = connections['default'].get_query()
+            query.backend = self.backend
+            query.add_filter(SQ(name__startswith='David'))
+            self.assertEqual(pks(self.backend.search(query.build_query())['results']), [1, 2, 3])
+        finally:
+            self.backend.exact_fields = old_exact_fields
+            self.backend._fields = None
+
+    def test_prefix_fields(self):
+        self.assertEqual(_prefix_terms('XNAME', ' Da  Vid', 4),
+                         ['XPNAME:d', 'XPNAME:da', 'XPNAME:da ', 'XPNAME:da v'])
+
+        old_prefix_fields = self.backend.prefix_fields
+        self.backend.prefix_fields = frozenset(['name'])
+        self.backend._fields = None  # rebuilds the schema
+        try:
+            self.backend.update(self.index, self.sample_objs)
+            terms = get_terms(self.backend, '-a')
+            self.assertTrue('XPNAME:d' in terms)
+            self.assertTrue('XPNAME:david1' in terms)
+
+            query = connections['default'].get_query()
+            query.backend = self.backend
+            query.add_filter(SQ(name__startswith='Da'))
+            self.assertEqual(str(query.build_query()), 'Xapian::Query(XPNAME:da)')
+            self.assertEqual(pks(self.backend.search(query.build_query())['results']), [1, 2, 3])
+        finally:
+            self.backend.prefix_fields = old_prefix_fields
+            self.backend._fields = None
+
+    def test_startswith(self):
+        def search(**kwargs):
+            query = connections['default'].get_query()
+            query.backend = self.backend
+            query.add_filter(SQ(**kwargs))
+            return pks(self.backend.search(query.build_query())['results'])
+
+        self.assertEqual(search(name__startswith='dav'), [1, 2, 3])
+        self.assertEqual(search(titles__startswith='obj'), [1, 2, 3])
+        self.assertEqual(search(titles__startswith='object t'), [])
+        # only the beginning of each value matches
+        self.assertEqual(search(titles__startswith='tit'), [])
+        self.assertEqual(search(titles__startswith='tw'), [])
+
+        if not hasattr(xapian.Query, 'OP_WILDCARD'):
+            return
+
+        # words split by the indexer match the phrase of their terms
+        self.assertEqual(search(url__startswith='http://exa'), [1, 2, 3])
+        self.assertEqual(search(url__startswith='http://example.com/2'), [2])
+        self.sample_objs[0].author = 'David-Holland'
+        self.backend.update(self.index, self.sample_objs[:1])
+        self.assertEqual(search(name__startswith='david-h'), [1])
+        self.assertEqual(search(name__startswith='david-x'), [])
+
+        old_limit = self.backend.wildcard_expansion_limit
+        old_strategy = self.backend.wildcard_expansion_strategy
+        self.backend.wildcard_expansion_limit = 1
+        try:
+            self.assertRaises(xapian.WildcardError, search, name__startswith='dav')
+            self.assertEqual(search(name__startswith='david2'), [2])
+
+            self.backend.wildcard_expansion_strategy = 'first'
+            self.assertEqual(search(name__startswith='dav'), [1])
+            self.assertEqual(search(titles__startswith='obj'), [1, 2, 3])
+
+            self.backend.wildcard_expansion_strategy = 'most_frequent'
+            self.assertEqual(len(search(name__startswith='dav')), 1)
+        finally:
+            self.backend.wildcard_expansion_limit = old_limit
+            self.backend.wildcard_expansion_strategy = old_strategy
+
     def test_build_schema(self):
         search_fields = connections['default'].get_unified_index().all_searchfields()
         (content_field_name, fields) = self.backend.build_schema(search_fields)
@@ -646,6 +1305,30 @@ class BackendFeaturesTestCase(HaystackBackendTestCase, TestCase):
             {'column': 16, 'type': 'integer', 'field_name': 'value', 'multi_valued': 'false'}
         ])
 
+    def test_schema_snapshot(self):
+        schema = self.backend._update_cache()
+        self.assertTrue(self.backend._update_cache() is schema)
+        self.assertEqual(schema.by_name['pub_date']['column'], 10)
+        self.assertEqual(schema.columns['value'], 16)
+        self.assertEqual(schema.types['popularity'], 'float')
+        self.assertEqual(schema.prefixes['name'], 'XNAME')
+        self.assertEqual(schema.multi_valued, frozenset(['keys', 'sites', 'tags', 'titles']))
+        self.assertTrue(self.backend._multi_value_field('sites'))
+        self.assertFalse(self.backend._multi_value_field('name'))
+
+        # an equal set of fields keeps the snapshot
+        self.backend._fields = dict(self.backend._fields)
+        self.assertTrue(self.backend._update_cache() is schema)
+
+    def test_indexing_plan(self):
+        plan = dict((entry[0], entry) for entry in self.backend.indexing_plan)
+
+        self.assertEqual(len(plan), 14 + 3)
+        self.assertEqual(plan['django_id'][3], 'QQ')
+        self.assertEqual(plan['name'][3], 'XNAME')
+        self.assertEqual(plan['pub_date'][1], 'date')
+        self.assertEqual(plan['pub_date'][2], self.backend.column['pub_date'])
+
     def test_parse_query(self):
         self.assertEqual(str(self.backend.parse_query('indexed')),
                          'Xapian::Query(Zindex:(pos=1))')
@@ -766,6 +1449,49 @@ class IndexationNGramTestCase(HaystackBackendTestCase, TestCase):
         self.assertEqual(pks(self.backend.search(xapian.Query('da1'))['results']),
                 [2])
 
+    def test_ngram_lengths(self):
+        self.backend.ngram_lengths = {'ngram': (3, 4)}
+        self.backend.ngram_skip_unprefixed = True
+        self.backend._fields = None  # rebuilds the schema
+        try:
+            self.backend.clear()
+            mock = XapianMockModel()
+            mock.id = 1
+            mock.author = u'david'
+            self.backend.update(self.index, [mock])
+
+            terms = get_terms(self.backend, '-a')
+            self.assertTrue('XNGRAMdav' in terms)
+            self.assertTrue('XNGRAMdavi' in terms)
+            self.assertFalse('XNGRAMda' in terms)
+            self.assertFalse('XNGRAMdavid' in terms)
+            self.assertFalse('dav' in terms)
+        finally:
+            self.backend.ngram_lengths = {}
+            self.backend.ngram_skip_unprefixed = False
+            self.backend._fields = None
+
+
+class IndexationNGramLengthsTestCase(HaystackBackendTestCase, TestCase):
+    def get_index(self):
+        return XapianNGramLengthsIndex()
+
+    def test_field(self):
+        mock = XapianMockModel()
+        mock.id = 1
+        mock.author = u'david'
+        self.backend.update(self.index, [mock])
+
+        terms = get_terms(self.backend, '-a')
+        self.assertTrue('XNGRAMdav' in terms)
+        self.assertTrue('XNGRAMavid' in terms)
+        self.assertFalse('XNGRAMda' in terms)
+        self.assertFalse('XNGRAMdavid' in terms)
+
+        self.assertTrue('XEDGE_NGRAMda' in terms)
+        self.assertTrue('XEDGE_NGRAMdav' in terms)
+        self.assertFalse('XEDGE_NGRAMdavi' in terms)
+
 
 class IndexationEdgeNGramTestCase(HaystackBackendTestCase, TestCase):
     def get_index(self):
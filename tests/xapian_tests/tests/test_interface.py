@@ -1,10 +1,12 @@
 from __future__ import unicode_literals
 
 import datetime
+import xapian
 from django.db.models import Q
 from django.test import TestCase
 
 from haystack import connections
+from haystack.backends.xapian_backend import InvalidIndexError, TERM_PREFIXES
 from haystack.inputs import AutoQuery
 from haystack.query import SearchQuerySet
 
@@ -138,6 +140,47 @@ class InterfaceTestCase(TestCase):
         self.assertEqual(set(pks(self.queryset.filter(summary__startswith='This is a huge'))),
                          set(pks(Document.objects.filter(summary__startswith='This is a huge'))))
 
+        # single words only match the beginning of the field
+        for value in ('This', 'huge', 'magazine', '4'):
+            self.assertEqual(set(pks(self.queryset.filter(summary__startswith=value))),
+                             set(pks(Document.objects.filter(summary__startswith=value))))
+            self.assertEqual(set(pks(self.queryset.filter(name__startswith=value))),
+                             set(pks(Document.objects.filter(name__startswith=value))))
+
+    def test_parallel_rebuild(self):
+        self.backend.clear()
+        self.backend.parallel_rebuild(self.index, Document.objects.all(), processes=2)
+        self.assertEqual(self.backend.document_count(), 12)
+        self.assertEqual(set(pks(self.queryset.filter(name__startswith='magazine'))),
+                         set(pks(Document.objects.filter(name__startswith='magazine'))))
+        self.assertEqual(set(pks(self.queryset.filter(number__in=[2, 24]))),
+                         set(pks(Document.objects.filter(number__in=[2, 24]))))
+
+        # a failing process leaves the index unchanged
+        self.backend.remove(Document.objects.get(number=2))
+        old_prepare_tags = DocumentIndex.prepare_tags
+        DocumentIndex.prepare_tags = lambda index, obj: ['tag'] if 1 / (obj.number - 24) else []
+        try:
+            self.assertRaises(ZeroDivisionError, self.backend.parallel_rebuild, self.index,
+                              Document.objects.all(), processes=2)
+        finally:
+            DocumentIndex.prepare_tags = old_prepare_tags
+        self.assertEqual(self.backend.document_count(), 11)
+
+        # without an index, every index of the unified index is rebuilt
+        self.backend.parallel_rebuild(processes=2)
+        self.assertEqual(self.backend.document_count(), 12)
+
+        # rebuilding a single index does not delete the documents of other models
+        database = xapian.WritableDatabase(self.backend.path, xapian.DB_OPEN)
+        document = xapian.Document()
+        document.add_term(TERM_PREFIXES['django_ct'] + 'core.mockmodel')
+        database.add_document(document)
+        database.close()
+        self.assertRaises(InvalidIndexError, self.backend.parallel_rebuild, self.index,
+                          Document.objects.all(), processes=2)
+        self.assertEqual(self.backend.document_count(), 13)
+
     def test_auto_query(self):
         # todo: improve to query text only.
         self.assertEqual(set(pks(self.queryset.auto_query("huge OR medium"))),
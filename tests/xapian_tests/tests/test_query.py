@@ -162,7 +162,7 @@ class XapianSearchQueryTestCase(HaystackBackendTestCase, TestCase):
         self.sq.add_filter(~SQ(title__in=["Dune", "Jaws"]))
         self.assertEqual(str(self.sq.build_query()),
                          'Xapian::Query('
-                         '((Zwhi OR why) AND '
+                         '((Zwhi OR why) FILTER '
                          '(<alldocuments> AND_NOT ('
                          '(XTITLE^ PHRASE 3 XTITLEdune PHRASE 3 XTITLE$) OR '
                          '(XTITLE^ PHRASE 3 XTITLEjaws PHRASE 3 XTITLE$)))))')
@@ -172,7 +172,7 @@ class XapianSearchQueryTestCase(HaystackBackendTestCase, TestCase):
         self.sq.add_filter(SQ(title__in=["A Famous Paper", "An Infamous Article"]))
         self.assertEqual(str(self.sq.build_query()),
                          'Xapian::Query(('
-                         '(Zwhi OR why) AND ((XTITLE^ PHRASE 5 XTITLEa PHRASE 5 '
+                         '(Zwhi OR why) FILTER ((XTITLE^ PHRASE 5 XTITLEa PHRASE 5 '
                          'XTITLEfamous PHRASE 5 XTITLEpaper PHRASE 5 XTITLE$) OR '
                          '(XTITLE^ PHRASE 5 XTITLEan PHRASE 5 XTITLEinfamous PHRASE 5 '
                          'XTITLEarticle PHRASE 5 XTITLE$))))')
@@ -193,7 +193,7 @@ class XapianSearchQueryTestCase(HaystackBackendTestCase, TestCase):
         self.sq.add_filter(~SQ(title__in=["A Famous Paper", "An Infamous Article"]))
         self.assertEqual(str(self.sq.build_query()),
                          'Xapian::Query(('
-                         '(Zwhi OR why) AND (<alldocuments> AND_NOT '
+                         '(Zwhi OR why) FILTER (<alldocuments> AND_NOT '
                          '((XTITLE^ PHRASE 5 XTITLEa PHRASE 5 XTITLEfamous PHRASE 5 '
                          'XTITLEpaper PHRASE 5 XTITLE$) OR (XTITLE^ PHRASE 5 '
                          'XTITLEan PHRASE 5 XTITLEinfamous PHRASE 5 '
@@ -203,7 +203,7 @@ class XapianSearchQueryTestCase(HaystackBackendTestCase, TestCase):
         self.sq.add_filter(SQ(content='why'))
         self.sq.add_filter(SQ(pub_date__in=[datetime.datetime(2009, 7, 6, 1, 56, 21)]))
         self.assertEqual(str(self.sq.build_query()),
-                         'Xapian::Query(((Zwhi OR why) AND '
+                         'Xapian::Query(((Zwhi OR why) FILTER '
                          '(XPUB_DATE2009-07-06 AND_MAYBE XPUB_DATE01:56:21)))')
 
     def test_clean(self):
@@ -218,18 +218,18 @@ class XapianSearchQueryTestCase(HaystackBackendTestCase, TestCase):
         self.sq.add_filter(SQ(content='hello'))
         self.sq.add_model(MockModel)
         self.assertEqual(str(self.sq.build_query()),
-                         'Xapian::Query(((Zhello OR hello) AND '
-                         '0 * CONTENTTYPEcore.mockmodel))')
+                         'Xapian::Query(((Zhello OR hello) FILTER '
+                         'CONTENTTYPEcore.mockmodel))')
 
         self.sq.add_model(AnotherMockModel)
 
         self.assertTrue(str(self.sq.build_query()) in (
-            'Xapian::Query(((Zhello OR hello) AND '
-            '(0 * CONTENTTYPEcore.anothermockmodel OR '
-            '0 * CONTENTTYPEcore.mockmodel)))',
-            'Xapian::Query(((Zhello OR hello) AND '
-            '(0 * CONTENTTYPEcore.mockmodel OR '
-            '0 * CONTENTTYPEcore.anothermockmodel)))'))
+            'Xapian::Query(((Zhello OR hello) FILTER '
+            '(CONTENTTYPEcore.anothermockmodel OR '
+            'CONTENTTYPEcore.mockmodel)))',
+            'Xapian::Query(((Zhello OR hello) FILTER '
+            '(CONTENTTYPEcore.mockmodel OR '
+            'CONTENTTYPEcore.anothermockmodel)))'))
 
     def test_build_query_with_punctuation(self):
         self.sq.add_filter(SQ(content='http://www.example.com'))
@@ -241,7 +241,7 @@ class XapianSearchQueryTestCase(HaystackBackendTestCase, TestCase):
         self.sq.add_filter(SQ(title__in=MockModel.objects.values_list('id', flat=True)))
         self.assertEqual(str(self.sq.build_query()),
                          'Xapian::Query('
-                         '((Zwhi OR why) AND ('
+                         '((Zwhi OR why) FILTER ('
                          '(XTITLE^ PHRASE 3 XTITLE1 PHRASE 3 XTITLE$) OR '
                          '(XTITLE^ PHRASE 3 XTITLE2 PHRASE 3 XTITLE$) OR '
                          '(XTITLE^ PHRASE 3 XTITLE3 PHRASE 3 XTITLE$))))')
@@ -314,12 +314,36 @@ class SearchQueryTestCase(HaystackBackendTestCase, TestCase):
         self.sq.add_filter(SQ(title__gte='B'))
         self.sq.add_filter(SQ(django_id__in=[1, 2, 3]))
         self.assertEqual(str(self.sq.build_query()),
-                         'Xapian::Query(((Zwhi OR why) AND '
-                         'VALUE_RANGE 5 00010101000000 20090210015900 AND '
+                         'Xapian::Query(((Zwhi OR why) FILTER '
+                         '(VALUE_RANGE 5 00010101000000 20090210015900 AND '
                          '(<alldocuments> AND_NOT VALUE_RANGE 3 a david) AND '
                          'VALUE_RANGE 7 b zzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzz'
                          'zzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzzz AND '
-                         '(QQ000000000001 OR QQ000000000002 OR QQ000000000003)))')
+                         '(QQ000000000001 OR QQ000000000002 OR QQ000000000003))))')
+
+    def test_build_query_in_filter_private_fields(self):
+        self.sq.add_filter(SQ(id__in=['core.mockmodel.1', 'core.mockmodel.2', 'core.mockmodel.1']))
+        self.assertEqual(str(self.sq.build_query()),
+                         'Xapian::Query((Qcore.mockmodel.1 OR Qcore.mockmodel.2))')
+        self.assertEqual([result.pk for result in self.sq.get_results()], [1, 2])
+
+        # large lists are a flat OR of terms
+        self.sq = connections['default'].get_query()
+        self.sq.add_filter(SQ(django_id__in=range(1, 5001)))
+        self.assertEqual(self.sq.get_count(), MockModel.objects.count())
+
+    def test_build_params_boolean_query(self):
+        self.sq.add_filter(SQ(name__gt='david'))
+        self.sq.add_filter(SQ(django_id__in=[1, 2, 3]))
+        self.sq.add_model(MockModel)
+        self.sq.build_query()
+        self.assertTrue(self.sq.build_params()['boolean_query'])
+        self.assertEqual([result.pk for result in self.sq.get_results()], [1, 2, 3])
+
+        # a text part ranks the results
+        self.sq.add_filter(SQ(content='why'))
+        self.sq.build_query()
+        self.assertNotIn('boolean_query', self.sq.build_params())
 
     def test_log_query(self):
         reset_search_queries()
@@ -392,6 +416,14 @@ class LiveSearchQuerySetTestCase(HaystackBackendTestCase, TestCase):
     def test_facet(self):
         self.assertEqual(len(self.sqs.facet('name').facet_counts()['fields']['name']), 3)
 
+    def test_count(self):
+        sqs = self.sqs.all()
+        self.assertEqual(sqs.count(), MockModel.objects.count())
+        # counting does not fetch the results
+        self.assertEqual(sqs.query._results, None)
+
+        self.assertEqual(self.sqs.filter(name='daniel1').count(), 1)
+
 
 class BoostMockSearchIndex(indexes.SearchIndex):
     text = indexes.CharField(
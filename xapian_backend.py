@@ -1,22 +1,37 @@
 from __future__ import unicode_literals
 
 import time
+import bisect
+import copy
 import datetime
+import functools
+import hashlib
+import importlib
+import math
+import multiprocessing
+import multiprocessing.pool
 import pickle
 import os
 import re
 import shutil
 import sys
+import tempfile
+import threading
+import struct
+import zlib
+from collections import OrderedDict, namedtuple
 
 from django.utils import six
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connections as db_connections
 from django.utils.encoding import force_text
 
 from haystack import connections
 from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, SearchNode, log_query
 from haystack.constants import ID, DJANGO_ID, DJANGO_CT, DEFAULT_OPERATOR
-from haystack.exceptions import HaystackError, MissingDependency
+from haystack.exceptions import FacetingError, HaystackError, MissingDependency
+from haystack.fields import EdgeNgramField, NgramField
 from haystack.inputs import AutoQuery
 from haystack.models import SearchResult
 from haystack.utils import get_identifier, get_model_ct
@@ -37,12 +52,20 @@ except ImportError:
 # django_id int: id of the django model instance.
 # django_ct str: of the content type of the django model.
 # field str: name of the field of the index.
+# exact str: exact value of a field of `EXACT_FIELDS`, see `_exact_term`.
+# prefix str: leading characters of a field of `PREFIX_FIELDS`, see `_prefix_terms`.
 TERM_PREFIXES = {'id': 'Q',
                  'django_id': 'QQ',
                  'django_ct': 'CONTENTTYPE',
-                 'field': 'X'
+                 'field': 'X',
+                 'exact': 'XE',
+                 'prefix': 'XP',
                  }
 
+# maximum length in bytes of a term in Xapian;
+# longer exact values are replaced by their sha1.
+MAX_TERM_LENGTH = 245
+
 MEMORY_DB_NAME = ':memory:'
 
 DEFAULT_XAPIAN_FLAGS = (
@@ -60,10 +83,81 @@ XAPIAN_OPTS = {'AND': xapian.Query.OP_AND,
                'NEAR': xapian.Query.OP_NEAR
                }
 
+# number of documents replaced inside a single transaction by `update`;
+# each batch is committed atomically. `None` or 0 disables transactions.
+DEFAULT_BATCH_COMMIT_SIZE = 1000
+
+# number of leading characters of the values of `PREFIX_FIELDS` indexed as terms;
+# longer `startswith` filters use a wildcard.
+DEFAULT_PREFIX_MAX_LENGTH = 10
+
+# how a wildcard expanding to more than `WILDCARD_EXPANSION_LIMIT` terms is handled:
+# 'error' raises an error, 'first' keeps the first terms in alphabetical order,
+# 'most_frequent' the terms of most documents. Only 'error' exists before Xapian 1.4.
+WILDCARD_EXPANSION_STRATEGIES = ('error', 'first', 'most_frequent')
+
 # number of documents checked by default when building facets
 # this must be improved to be relative to the total number of docs.
 DEFAULT_CHECK_AT_LEAST = 1000
 
+# number of matches fetched at a time by the results
+# of searches without `end_offset`; 0 fetches all of them at once.
+DEFAULT_RESULTS_WINDOW_SIZE = 100
+
+# number of counts of `XapianSearchBackend.count` cached by database revision;
+# 0 disables the cache.
+DEFAULT_COUNT_CACHE_SIZE = 1000
+
+# number of spelling suggestions of words cached by database revision;
+# 0 disables the cache.
+DEFAULT_SPELLING_CACHE_SIZE = 1000
+
+# number of seconds a read-only database is reused without checking whether
+# it was modified by another process, see `XHReaderPool`.
+DEFAULT_READER_STALENESS = 1
+
+# pools of read-only databases, by path and staleness; they are shared by
+# all backends, so that the writes of each reach the readers of the others.
+_reader_pools = {}
+_reader_pools_lock = threading.Lock()
+
+# number of threads counting the query facets of a search;
+# 0 or 1 counts them in the thread of the search.
+DEFAULT_QUERY_FACET_THREADS = 0
+
+# pools of threads counting query facets, by number of threads; they are
+# shared by all backends, since Haystack creates a backend per thread.
+_query_facet_pools = {}
+_query_facet_pools_lock = threading.Lock()
+
+# how the number of hits of a search is computed:
+# 'exact' checks every matching document,
+# 'estimated' returns Xapian's estimate after checking `HIT_COUNT_CHECK_AT_LEAST` documents,
+# 'bounded' returns the lower bound of that estimate.
+HIT_COUNT_MODES = ('exact', 'estimated', 'bounded')
+
+# first byte of the document data written by `XHCompactCodec`;
+# data written by `XHPickleCodec` starts with a pickle opcode instead.
+# Version 1 stored the name of each field, version 2 its number in the
+# `stored_field_names` of the schema, see `XHSchema`.
+COMPACT_CODEC_VERSION = 2
+COMPACT_CODEC_VERSIONS = (1, 2)
+
+# key of the metadata of a database recording the `stored_field_names`
+# of the schema whose fingerprint it is formatted with.
+STORED_FIELDS_METADATA_KEY = 'xapian_haystack.stored_fields.%08x'
+
+# the stored field names read from the metadata of databases, by fingerprint
+_stored_field_names = {}
+
+# compression of the document data written by `XHCompactCodec`,
+# stored in the byte following the version.
+COMPRESSIONS = {None: 0, 'zlib': 1, 'lz4': 2}
+
+# filter types of `XapianSearchQuery` that only restrict the matches;
+# their queries are combined with OP_FILTER and do not contribute weights.
+FILTER_TYPES = ('exact', 'in', 'gt', 'gte', 'lt', 'lte')
+
 # field types accepted to be serialized as values in Xapian
 FIELD_TYPES = {'text', 'integer', 'date', 'datetime', 'float', 'boolean',
     'edge_ngram', 'ngram'}
@@ -73,10 +167,33 @@ FIELD_TYPES = {'text', 'integer', 'date', 'datetime', 'float', 'boolean',
 DATETIME_FORMAT = '%Y%m%d%H%M%S'
 INTEGER_FORMAT = '%012d'
 
+# encodings of the values of integer, date and datetime fields, selected by
+# `VALUE_ENCODING`: the first stores `INTEGER_FORMAT` and `DATETIME_FORMAT`
+# strings, the second stores them with `xapian.sortable_serialise`
+# (dates as the number written by `DATETIME_FORMAT`).
+LEGACY_VALUE_ENCODING = 1
+SORTABLE_VALUE_ENCODING = 2
+VALUE_ENCODINGS = (LEGACY_VALUE_ENCODING, SORTABLE_VALUE_ENCODING)
+
+# key of the metadata of a database recording the encoding of its values
+VALUE_ENCODING_METADATA_KEY = 'xapian_haystack.value_encoding'
+
 # defines the distance given between
 # texts with positional information
 TERMPOS_DISTANCE = 100
 
+# an item of the values of `XHMultiValueCountMatchSpy`, with the
+# same attributes as the items of `xapian.ValueCountMatchSpy.values`.
+XHFacetCount = namedtuple('XHFacetCount', ['term', 'termfreq'])
+
+# the values of a multi valued field are also stored one per value slot,
+# so that facets count them with `xapian.ValueCountMatchSpy`: the slots
+# of the field of column `c` start at MULTI_VALUE_SLOT_START + c * MULTI_VALUE_SLOTS,
+# see `_multi_value_slot`. Values past the first `MULTI_VALUE_SLOTS` are not counted.
+MULTI_VALUE_SLOT_START = 1 << 24
+MULTI_VALUE_SLOTS = 1 << 16
+
+
 class InvalidIndexError(HaystackError):
     """Raised when an index can not be opened."""
     pass
@@ -102,36 +219,59 @@ class XHValueRangeProcessor(xapian.ValueRangeProcessor):
         colon = begin.find(':')
         field_name = begin[:colon]
         begin = begin[colon + 1:len(begin)]
-        for field_dict in self.backend.schema:
-            if field_dict['field_name'] == field_name:
-                field_type = field_dict['type']
-
-                if not begin:
-                    if field_type == 'text':
-                        begin = 'a'  # TODO: A better way of getting a min text value?
-                    elif field_type == 'integer':
-                        begin = -sys.maxsize - 1
-                    elif field_type == 'float':
-                        begin = float('-inf')
-                    elif field_type == 'date' or field_type == 'datetime':
-                        begin = '00010101000000'
-                elif end == '*':
-                    if field_type == 'text':
-                        end = 'z' * 100  # TODO: A better way of getting a max text value?
-                    elif field_type == 'integer':
-                        end = sys.maxsize
-                    elif field_type == 'float':
-                        end = float('inf')
-                    elif field_type == 'date' or field_type == 'datetime':
-                        end = '99990101000000'
+        field_dict = self.backend._update_cache().by_name.get(field_name)
+        if field_dict is not None:
+            field_type = field_dict['type']
 
+            if not begin:
+                if field_type == 'text':
+                    begin = 'a'  # TODO: A better way of getting a min text value?
+                elif field_type == 'integer':
+                    begin = -sys.maxsize - 1
+                elif field_type == 'float':
+                    begin = float('-inf')
+                elif field_type == 'date' or field_type == 'datetime':
+                    begin = '00010101000000'
+            elif end == '*':
+                if field_type == 'text':
+                    end = 'z' * 100  # TODO: A better way of getting a max text value?
+                elif field_type == 'integer':
+                    end = sys.maxsize
+                elif field_type == 'float':
+                    end = float('inf')
+                elif field_type == 'date' or field_type == 'datetime':
+                    end = '99990101000000'
+
+            value_encoding = _field_value_encoding(field_name, self.backend.value_encoding)
+            try:
                 if field_type == 'float':
                     begin = _term_to_xapian_value(float(begin), field_type)
                     end = _term_to_xapian_value(float(end), field_type)
                 elif field_type == 'integer':
-                    begin = _term_to_xapian_value(int(begin), field_type)
-                    end = _term_to_xapian_value(int(end), field_type)
-                return field_dict['column'], str(begin), str(end)
+                    begin = _term_to_xapian_value(int(begin), field_type, value_encoding)
+                    end = _term_to_xapian_value(int(end), field_type, value_encoding)
+                elif field_type in ('date', 'datetime') and value_encoding == SORTABLE_VALUE_ENCODING:
+                    begin = xapian.sortable_serialise(self._date_bound(begin))
+                    end = xapian.sortable_serialise(self._date_bound(end))
+            except ValueError:
+                # not a range of this field
+                return xapian.BAD_VALUENO
+            if value_encoding == SORTABLE_VALUE_ENCODING:
+                return field_dict['column'], begin, end
+            return field_dict['column'], str(begin), str(end)
+
+    @staticmethod
+    def _date_bound(bound):
+        """
+        Returns the number written by `DATETIME_FORMAT` for a date bound,
+        e.g. '2009-01-01' or '20090101'; missing digits are zeros.
+
+        Raises `ValueError` if `bound` is not a date.
+        """
+        digits = re.sub(r'\D', '', bound)
+        if not digits or len(digits) > 14:
+            raise ValueError('Invalid date bound: %r' % bound)
+        return int(digits.ljust(14, '0'))
 
 
 class XHExpandDecider(xapian.ExpandDecider):
@@ -140,13 +280,714 @@ class XHExpandDecider(xapian.ExpandDecider):
         Return True if the term should be used for expanding the search
         query, False otherwise.
 
-        Ignore terms related with the content type of objects.
+        Ignore terms related with the content type and the identifiers of objects.
         """
         if term.startswith(TERM_PREFIXES['django_ct']):
             return False
+        if term.startswith(TERM_PREFIXES['id']) or term.startswith(TERM_PREFIXES['django_id']):
+            return False
         return True
 
 
+class XHMultiValueCountMatchSpy(object):
+    """
+    Counts, like `xapian.ValueCountMatchSpy`, how many matching documents
+    have each value of the multi valued field of column `slot`.
+
+    Each value of a document is stored in a slot of its own (see
+    `_multi_value_slot`) and counted during the match by one of `spies`,
+    a `xapian.ValueCountMatchSpy` for each slot used in `database`,
+    so no Python code runs for each matching document.
+    """
+    def __init__(self, database, slot):
+        self.slot = slot
+        self.spies = []
+        for position in six.moves.range(MULTI_VALUE_SLOTS):
+            value_slot = _multi_value_slot(slot, position)
+            # a document with a value in a slot has values in the previous ones
+            if not database.get_value_freq(value_slot):
+                break
+            self.spies.append(xapian.ValueCountMatchSpy(value_slot))
+
+    def values(self):
+        """
+        Returns a list of `XHFacetCount` sorted by value.
+        """
+        counts = {}
+        for spy in self.spies:
+            for item in spy.values():
+                counts[item.term] = counts.get(item.term, 0) + item.termfreq
+
+        facets = []
+        for term, count in sorted(counts.items()):
+            try:
+                term = term.decode('utf-8')
+            except (AttributeError, UnicodeDecodeError):
+                pass
+            facets.append(XHFacetCount(term, count))
+        return facets
+
+
+class XHReaderPool(object):
+    """
+    A pool of read-only databases, one per thread, reused across requests.
+
+    A database is only reopened when it may be stale: after a write made by
+    a backend sharing the pool or, for writes made by other processes, at
+    most once every `staleness` seconds. A database replaced by `clear` or
+    `publish` is opened again from scratch, and so is a database pinned by
+    lazy results (see `pin`) instead of being reopened under them.
+
+    The counters returned by `stats` count how many times a database was
+    reused (`hits`), opened (`misses`) and reopened on a new revision (`reopens`).
+    """
+    def __init__(self, path, staleness=DEFAULT_READER_STALENESS):
+        self.path = path
+        self.staleness = staleness
+        # `generation` changes when the database is replaced and
+        # `writes` when it is modified by the backend.
+        self.generation = 0
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reopens = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the database of the current thread, opening it if needed.
+        """
+        local = self._local
+        database = getattr(local, 'database', None)
+
+        if database is not None and local.generation == self.generation:
+            now = time.time()
+            if local.writes == self.writes and now - local.checked < self.staleness:
+                self._count('hits')
+                return database
+
+            local.checked = now
+            local.writes = self.writes
+            if not local.pinned and os.path.realpath(self.path) == local.realpath:
+                state = self._get_state(database)
+                try:
+                    database.reopen()
+                except xapian.DatabaseError:
+                    pass
+                else:
+                    if self._get_state(database) == state:
+                        self._count('hits')
+                    else:
+                        self._count('reopens')
+                    return database
+
+        return self._open()
+
+    @staticmethod
+    def _get_state(database):
+        """
+        Returns what changes when `database` is reopened on a new revision,
+        approximately on versions of Xapian without revisions.
+        """
+        return (_get_version(database), database.get_lastdocid(),
+                database.get_doccount(), database.get_avlength())
+
+    def _open(self):
+        local = self._local
+        try:
+            local.database = xapian.Database(self.path)
+        except xapian.DatabaseOpeningError:
+            local.database = None
+            raise InvalidIndexError('Unable to open index at %s' % self.path)
+
+        self._count('misses')
+        local.pinned = False
+        local.generation = self.generation
+        local.writes = self.writes
+        local.checked = time.time()
+        local.realpath = os.path.realpath(self.path)
+        return local.database
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def pin(self):
+        """
+        Marks the database of the current thread as read by lazy results:
+        it keeps being reused while it is up to date, but when it may be
+        stale a new database is opened instead of reopening it.
+        """
+        self._local.pinned = True
+
+    def modified(self):
+        """
+        Marks the databases of all threads as possibly stale.
+        """
+        self._count('writes')
+
+    def replaced(self):
+        """
+        Marks the databases of all threads as replaced.
+        """
+        self._count('generation')
+
+    def stats(self):
+        """
+        Returns a dictionary with the `hits`, `misses` and `reopens` counters.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reopens': self.reopens,
+            }
+
+
+class XHLRUCache(object):
+    """
+    A thread-safe cache that keeps its `size` most recently used entries,
+    each for at most `timeout` seconds (or forever if `timeout` is None).
+
+    The counters returned by `stats` count the lookups that found an entry
+    (`hits`) or not (`misses`) and the entries evicted to make room (`evictions`).
+    """
+    def __init__(self, size, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the value of `key`, or `default` if it is not cached or expired.
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return default
+
+            self._entries[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Caches `value` as `key`, evicting the least recently used entry if full.
+        """
+        expires = time.time() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all entries; the counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns a dictionary with the `hits`, `misses` and `evictions` counters,
+        the number of entries (`size`) and the ratio of lookups that hit (`hit_rate`).
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+
+class XHHighlighter(object):
+    """
+    Highlights the terms of a query in texts with an html `tag`.
+
+    The terms are compiled once into a single pattern: their prefixes (the
+    reserved ones and the `prefixes` of the fields) are ignored, stemmed
+    terms match any word starting with the stem, and
+    each match is lower cased inside the tag, as the highlighting always
+    did. Terms of private fields (`id`, `django_id` and `django_ct`) are
+    not highlighted.
+
+    With `snippet_length` and the mset of the query (on Xapian >= 1.4),
+    `highlight` returns instead the most relevant window of about
+    `snippet_length` characters of the text, selected and highlighted by
+    `xapian.MSet.snippet`, which also escapes the text as html.
+    """
+    def __init__(self, query, tag='em', matches=None, snippet_length=None, language=None, prefixes=()):
+        """
+        Required arguments:
+            `query` -- The Xapian::query whose terms are highlighted
+
+        Optional arguments:
+            `tag` -- The html tag wrapping each match (default = 'em')
+            `prefixes` -- The term prefixes of the fields, e.g. 'XFIRST_NAME'
+            `matches` -- The mset of `query`, required by snippets
+            `snippet_length` -- If not None, the length of the returned snippets
+            `language` -- The language of the stemmer used by snippets
+        """
+        self.tag = tag
+        self.matches = matches
+        self.snippet_length = snippet_length
+        self.language = language
+        if matches is None or snippet_length is None or not hasattr(matches, 'snippet'):
+            self.snippet_length = None
+
+        # the exact and prefix terms of a field are prefixed by
+        # 'XE' or 'XP', the name of the field and ':'
+        known_prefixes = set()
+        for prefix in prefixes:
+            name = prefix[len(TERM_PREFIXES['field']):]
+            known_prefixes.update([prefix, '%s%s:' % (TERM_PREFIXES['exact'], name),
+                                   '%s%s:' % (TERM_PREFIXES['prefix'], name)])
+        # longest first, so that a prefix is not taken for the start of a longer one
+        known_prefixes = sorted(known_prefixes, key=len, reverse=True)
+
+        patterns = set()
+        for term in query:
+            if isinstance(term, six.binary_type):
+                term = term.decode('utf-8')
+            if term.startswith((TERM_PREFIXES['id'], TERM_PREFIXES['django_ct'])):
+                continue
+            # stemmed terms are prefixed by 'Z', before the prefix of their field
+            stemmed = term.startswith('Z')
+            if stemmed:
+                term = term[1:]
+            for prefix in known_prefixes:
+                if term.startswith(prefix):
+                    term = term[len(prefix):]
+                    break
+            if not re.search(r'\w', term, re.U):
+                continue
+            if stemmed:
+                patterns.add(r'\b%s\w*' % re.escape(term))
+            else:
+                patterns.add(r'\b%s\b' % re.escape(term))
+
+        self.pattern = None
+        if patterns:
+            # longest first, so that the longest term matches
+            self.pattern = re.compile('|'.join(sorted(patterns, key=len, reverse=True)), re.I | re.U)
+
+    def _replace(self, match):
+        return '<%s>%s</%s>' % (self.tag, match.group(0).lower(), self.tag)
+
+    def highlight(self, content):
+        """
+        Returns `content` with the terms of the query highlighted, or
+        its snippet if `snippet_length` is set.
+        """
+        if not content:
+            return content
+
+        if self.snippet_length is not None:
+            return self.matches.snippet(content, self.snippet_length, xapian.Stem(self.language),
+                                        xapian.MSet.SNIPPET_BACKGROUND_MODEL | xapian.MSet.SNIPPET_EXHAUSTIVE,
+                                        '<%s>' % self.tag, '</%s>' % self.tag, '...')
+
+        if self.pattern is None:
+            return content
+        return self.pattern.sub(self._replace, content)
+
+
+class XHSearchResults(object):
+    """
+    A read-only sequence with the results of a search.
+
+    The matches are fetched from Xapian in windows of `window_size`
+    documents as the sequence is iterated, indexed or sliced, and only
+    the current window is kept, so iterating over a search that matches
+    the whole collection does not load it at once.
+    """
+    def __init__(self, database, enquire, start_offset, length, window_size, make_result, matches=None):
+        """
+        Required arguments:
+            `database` -- The database that was queried, pinned in the reader
+                          pool so that later searches do not reopen it
+            `enquire` -- The enquire instance of the search
+            `start_offset` -- The offset of the first result of the sequence
+            `length` -- The number of results of the sequence, or None to count
+                        them when first needed
+            `window_size` -- The number of matches fetched at a time
+            `make_result` -- A function that returns the result of a match
+
+        Optional arguments:
+            `matches` -- The first window of matches, if already fetched
+        """
+        self.database = database
+        self.enquire = enquire
+        self.start_offset = start_offset
+        self.length = None if length is None else max(length, 0)
+        self.window_size = window_size
+        self.make_result = make_result
+
+        self._window_start = 0
+        self._window = None
+        if matches is not None:
+            self._window = [make_result(match) for match in matches]
+
+    def _fetch(self, start, count):
+        """
+        Returns a list with `count` results from position `start`.
+        """
+        matches = XapianSearchBackend._get_enquire_mset(
+            self.database, self.enquire, self.start_offset + start, count, 0
+        )
+        return [self.make_result(match) for match in matches]
+
+    def __len__(self):
+        if self.length is None:
+            # the hit count of the search may be an estimate (see
+            # `HIT_COUNT_MODE`), but the sequence has as many results
+            # as can be fetched.
+            matches = XapianSearchBackend._get_enquire_mset(
+                self.database, self.enquire, 0, 0, self.database.get_doccount()
+            )
+            self.length = max(matches.get_matches_lower_bound() - self.start_offset, 0)
+        return self.length
+
+    def __bool__(self):
+        if self.length is None and self._window is not None and self._window_start == 0:
+            return len(self._window) > 0
+        return len(self) > 0
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        if self._window is not None and self._window_start == 0:
+            window = self._window
+        else:
+            window = self._fetch(0, self.window_size)
+
+        start = 0
+        while window:
+            for result in window:
+                yield result
+            if len(window) < self.window_size:
+                break
+            start += len(window)
+            window = self._fetch(start, self.window_size)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            positions = six.moves.range(start, stop, step)
+            if not positions:
+                return []
+            if abs(step) == 1:
+                first = min(positions[0], positions[-1])
+                results = self._fetch(first, abs(positions[-1] - positions[0]) + 1)
+                return [results[position - first] for position in positions if position - first < len(results)]
+
+            # a stepped slice only fetches the windows of its positions
+            results = []
+            for position in positions:
+                try:
+                    results.append(self[position])
+                except IndexError:
+                    pass
+            return results
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('search results index out of range')
+
+        window_start = index - index % self.window_size
+        if self._window is None or window_start != self._window_start:
+            self._window = self._fetch(window_start, self.window_size)
+            self._window_start = window_start
+        try:
+            return self._window[index - window_start]
+        except IndexError:
+            # the database was modified and reopened since `length` was counted
+            raise IndexError('search results index out of range')
+
+    def __repr__(self):
+        return '<XHSearchResults: %d results>' % len(self)
+
+
+class XHLazySearchResult(object):
+    """
+    A mixin of `SearchResult` classes whose results decode the stored data
+    of their document when one of their attributes is first accessed.
+
+    The classes are created by `_lazy_result_class`.
+    """
+    def __init__(self, data, score, load):
+        """
+        Required arguments:
+            `data` -- The stored data of the document
+            `score` -- The score of the result
+            `load` -- A function that decodes `data` into a tuple
+                      (app_label, model_name, pk, fields)
+        """
+        self.score = score
+        self._xh_data = data
+        self._xh_load = load
+
+    def _xh_decode(self):
+        load = self.__dict__.pop('_xh_load')
+        app_label, model_name, pk, model_data = load(self.__dict__.pop('_xh_data'))
+        super(XHLazySearchResult, self).__init__(app_label, model_name, pk, self.score, **model_data)
+
+    def __getattr__(self, attr):
+        if '_xh_load' in self.__dict__ and not attr.startswith('__'):
+            self._xh_decode()
+            return getattr(self, attr)
+
+        parent = getattr(super(XHLazySearchResult, self), '__getattr__', None)
+        if parent is None:
+            raise AttributeError(attr)
+        return parent(attr)
+
+    def __reduce__(self):
+        # the lazy class is not importable: pickle as the original class.
+        if '_xh_load' in self.__dict__:
+            self._xh_decode()
+        getstate = getattr(self, '__getstate__', None)
+        state = getstate() if getstate is not None else self.__dict__.copy()
+        return _new_instance, (self.__class__.__bases__[1],), state
+
+
+def _lazy_result_class(result_class):
+    """
+    Returns a subclass of `result_class` whose results are decoded lazily.
+    """
+    try:
+        return _LAZY_RESULT_CLASSES[result_class]
+    except KeyError:
+        lazy_class = type(str('Lazy%s' % result_class.__name__), (XHLazySearchResult, result_class), {})
+        _LAZY_RESULT_CLASSES[result_class] = lazy_class
+        return lazy_class
+
+_LAZY_RESULT_CLASSES = {}
+
+
+def _new_instance(cls):
+    """
+    Returns an instance of `cls` without initializing it (used when unpickling).
+    """
+    return cls.__new__(cls)
+
+
+class XHSchema(object):
+    """
+    An immutable snapshot of the schema of a backend, built from its search
+    fields by `XapianSearchBackend._update_cache`.
+
+    Besides the list of field dictionaries returned by `build_schema`
+    (`fields`), it holds lookups by field name so that indexing and querying
+    do not scan the schema: `by_name` (the field dictionaries), `columns`,
+    `types`, `prefixes` (of the terms parsed from queries),
+    `multi_valued`, `exact`, `prefix_indexed` and `multi_value_faceted` (sets
+    of names, the last three of the text fields of `EXACT_FIELDS`, of the
+    fields of `PREFIX_FIELDS` and of the multi valued fields that can be
+    faceted, those of `MULTI_VALUE_FACET_FIELDS`)
+    and `ngram_lengths`, the (minimum, maximum) lengths of the ngrams of each
+    ngram field. Those lengths come from its entry in `NGRAM_LENGTHS`, else
+    from its declaration (see `XHNgramField`), else from `NGRAM_MIN_LENGTH`
+    and `NGRAM_MAX_LENGTH`.
+
+    `version` is incremented on every snapshot of a backend.
+
+    `stored_field_names` numbers the fields for `XHCompactCodec`: the
+    fields of the schema by column, then the fields that are not indexed,
+    by name. `fingerprint` identifies it in the documents and in the
+    metadata of the databases (see `STORED_FIELDS_METADATA_KEY`).
+    """
+    def __init__(self, backend, search_fields, version):
+        self.version = version
+        self.content_field_name, self.fields = backend.build_schema(search_fields)
+
+        self.by_name = dict((field['field_name'], field) for field in self.fields)
+        self.columns = dict((name, field['column']) for name, field in self.by_name.items())
+        self.types = dict((name, field['type']) for name, field in self.by_name.items())
+        self.prefixes = dict((name, TERM_PREFIXES['field'] + name.upper()) for name in self.by_name)
+        self.multi_valued = frozenset(name for name, field in self.by_name.items()
+                                      if field['multi_valued'] == 'true')
+        self.exact = frozenset(name for name, field in self.by_name.items()
+                               if name in backend.exact_fields and field['type'] == 'text' and
+                               name not in ('id', 'django_id', 'django_ct'))
+        self.prefix_indexed = frozenset(name for name in self.by_name
+                                        if name in backend.prefix_fields and
+                                        name not in ('id', 'django_id', 'django_ct'))
+        self.multi_value_faceted = frozenset(name for name in self.multi_valued
+                                             if backend.multi_value_facet_fields is None or
+                                             name in backend.multi_value_facet_fields)
+
+        self.ngram_lengths = {}
+        for field in search_fields.values():
+            if field.field_type not in ('ngram', 'edge_ngram'):
+                continue
+            lengths = backend.ngram_lengths.get(field.index_fieldname) or (
+                getattr(field, 'ngram_min_length', None) or NGRAM_MIN_LENGTH,
+                getattr(field, 'ngram_max_length', None) or NGRAM_MAX_LENGTH)
+            if not 0 < lengths[0] <= lengths[1]:
+                raise ImproperlyConfigured("The ngram lengths of the field '%s' must be a minimum and "
+                                           "a maximum, with 0 < minimum <= maximum." % field.index_fieldname)
+            self.ngram_lengths[field.index_fieldname] = tuple(lengths)
+
+        self.indexing_plan = backend._build_indexing_plan(self.fields, self.exact, self.prefix_indexed,
+                                                          backend.prefix_max_length, self.ngram_lengths,
+                                                          not backend.ngram_skip_unprefixed,
+                                                          self.multi_value_faceted)
+        self.unstored_fields = frozenset(field.index_fieldname for field in search_fields.values()
+                                         if not getattr(field, 'stored', True))
+
+        stored_field_names = [field['field_name'] for field in self.fields]
+        stored_field_names.extend(sorted(set(field.index_fieldname for field in search_fields.values()) -
+                                         set(stored_field_names)))
+        self.stored_field_names = tuple(stored_field_names)
+        self.fingerprint = _fingerprint(self.stored_field_names)
+
+
+class XHNgramLengthsMixin(object):
+    """
+    A mixin of ngram fields accepting the minimum and maximum lengths
+    of their ngrams, `ngram_min_length` and `ngram_max_length`
+    (by default, `NGRAM_MIN_LENGTH` and `NGRAM_MAX_LENGTH`; see `XHSchema`).
+    """
+    def __init__(self, ngram_min_length=None, ngram_max_length=None, **kwargs):
+        self.ngram_min_length = ngram_min_length
+        self.ngram_max_length = ngram_max_length
+        super(XHNgramLengthsMixin, self).__init__(**kwargs)
+
+
+class XHNgramField(XHNgramLengthsMixin, NgramField):
+    """
+    A `NgramField` whose ngram lengths can be declared, e.g.
+    `XHNgramField(model_attr='name', ngram_min_length=3, ngram_max_length=5)`.
+    """
+    pass
+
+
+class XHEdgeNgramField(XHNgramLengthsMixin, EdgeNgramField):
+    """
+    An `EdgeNgramField` whose ngram lengths can be declared like those of `XHNgramField`.
+    """
+    pass
+
+
+class XHPickleCodec(object):
+    """
+    Stores the data of documents as a pickle of
+    (app_label, model_name, pk, fields).
+
+    A codec encodes the data stored in a document by `update` and decodes
+    it in the results of a search; it is selected by the `STORED_DATA_CODEC`
+    connection option. Both built-in codecs decode the data written by either.
+
+    `update` passes the `XHSchema` of the backend to `register_schema`,
+    with the database it writes to, and to `encode`; searches pass to
+    `decode` a function returning the `stored_field_names` of the schema
+    of a fingerprint (see `XapianSearchBackend._get_stored_field_names`).
+    """
+    def __init__(self, compression=None):
+        if compression is not None:
+            raise ImproperlyConfigured("The pickle codec does not support 'STORED_DATA_COMPRESSION'.")
+
+    def register_schema(self, database, schema):
+        pass
+
+    def encode(self, app_label, model_name, pk, data, schema=None):
+        return pickle.dumps((app_label, model_name, pk, data), pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data, fields=None, get_field_names=None):
+        """
+        Returns a tuple (app_label, model_name, pk, fields) from `data`.
+
+        If `fields` is not empty, fields not in it may be left out.
+        """
+        return _decode_stored_data(data, fields, get_field_names)
+
+
+class XHCompactCodec(XHPickleCodec):
+    """
+    Stores the data of documents in a compact binary format: a version byte,
+    a compression byte and the (optionally compressed) payload.
+
+    The payload holds the app label, model name and pk, the fingerprint of
+    the schema and each field with its value, prefixed by its length so that
+    fields which are not needed can be skipped when decoding. A field is
+    written as its number plus one in the `stored_field_names` of the
+    schema (see `XHSchema`), which `register_schema` records in the metadata
+    of the database, or as 0 followed by its name if the schema does not
+    have it. Values are tagged by type (see `_encode_stored_value`).
+    """
+    def __init__(self, compression=None):
+        if compression not in COMPRESSIONS:
+            raise ImproperlyConfigured("'STORED_DATA_COMPRESSION' must be one of %s."
+                                       % ', '.join(repr(name) for name in COMPRESSIONS))
+        if compression == 'lz4':
+            _import_lz4()
+        self.compression = compression
+
+    def register_schema(self, database, schema):
+        key = STORED_FIELDS_METADATA_KEY % schema.fingerprint
+        if not database.get_metadata(key):
+            database.set_metadata(key, '\n'.join(schema.stored_field_names))
+
+    def encode(self, app_label, model_name, pk, data, schema=None):
+        numbers = {}
+        fingerprint = 0
+        if schema is not None:
+            numbers = dict((name, number) for number, name in enumerate(schema.stored_field_names))
+            fingerprint = schema.fingerprint
+
+        payload = bytearray()
+        _encode_stored_value(payload, app_label)
+        _encode_stored_value(payload, model_name)
+        _encode_stored_value(payload, pk)
+        _encode_varint(payload, fingerprint)
+        _encode_varint(payload, len(data))
+        for field_name, value in data.items():
+            number = numbers.get(field_name)
+            if number is None:
+                _encode_varint(payload, 0)
+                _encode_stored_value(payload, field_name)
+            else:
+                _encode_varint(payload, number + 1)
+            encoded_value = bytearray()
+            _encode_stored_value(encoded_value, value)
+            _encode_varint(payload, len(encoded_value))
+            payload += encoded_value
+
+        payload = bytes(payload)
+        if self.compression == 'zlib':
+            payload = zlib.compress(payload)
+        elif self.compression == 'lz4':
+            payload = _import_lz4().compress(payload)
+
+        return bytes(bytearray([COMPACT_CODEC_VERSION, COMPRESSIONS[self.compression]])) + payload
+
+
+# built-in codecs that can be selected by name in `STORED_DATA_CODEC`.
+STORED_DATA_CODECS = {
+    'pickle': XHPickleCodec,
+    'compact': XHCompactCodec,
+}
+
+
 class XapianSearchBackend(BaseSearchBackend):
     """
     `SearchBackend` defines the Xapian search backend for use with the Haystack
@@ -191,43 +1032,185 @@ class XapianSearchBackend(BaseSearchBackend):
 
         self.flags = connection_options.get('FLAGS', DEFAULT_XAPIAN_FLAGS)
         self.language = getattr(settings, 'HAYSTACK_XAPIAN_LANGUAGE', 'english')
-
-        # these 4 attributes are caches populated in `build_schema`
-        # they are checked in `_update_cache`
-        # use property to retrieve them
-        self._fields = {}
-        self._schema = []
-        self._content_field_name = None
-        self._columns = {}
+        self.batch_commit_size = connection_options.get('BATCH_COMMIT_SIZE', DEFAULT_BATCH_COMMIT_SIZE)
+        self.staged_rebuild = connection_options.get('STAGED_REBUILD', False)
+        self.reader_pool = self._get_reader_pool(connection_options.get('READER_STALENESS',
+                                                                        DEFAULT_READER_STALENESS))
+
+        self.hit_count_mode = connection_options.get('HIT_COUNT_MODE', 'exact')
+        if self.hit_count_mode not in HIT_COUNT_MODES:
+            raise ImproperlyConfigured("'HIT_COUNT_MODE' of connection '%s' must be one of %s."
+                                       % (connection_alias, ', '.join(HIT_COUNT_MODES)))
+        self.hit_count_check_at_least = connection_options.get('HIT_COUNT_CHECK_AT_LEAST', DEFAULT_CHECK_AT_LEAST)
+        self.count_mode = connection_options.get('COUNT_MODE', self.hit_count_mode)
+        if self.count_mode not in HIT_COUNT_MODES:
+            raise ImproperlyConfigured("'COUNT_MODE' of connection '%s' must be one of %s."
+                                       % (connection_alias, ', '.join(HIT_COUNT_MODES)))
+        self.count_cache = None
+        if connection_options.get('COUNT_CACHE_SIZE', DEFAULT_COUNT_CACHE_SIZE):
+            self.count_cache = XHLRUCache(connection_options.get('COUNT_CACHE_SIZE', DEFAULT_COUNT_CACHE_SIZE))
+        self.results_window_size = connection_options.get('RESULTS_WINDOW_SIZE', DEFAULT_RESULTS_WINDOW_SIZE)
+        self.facet_check_at_least = connection_options.get('FACET_CHECK_AT_LEAST')
+        self.highlight_snippet_length = connection_options.get('HIGHLIGHT_SNIPPET_LENGTH')
+        self.spelling_max_hits = connection_options.get('SPELLING_MAX_HITS')
+        self.spelling_cache = None
+        if connection_options.get('SPELLING_CACHE_SIZE', DEFAULT_SPELLING_CACHE_SIZE):
+            self.spelling_cache = XHLRUCache(connection_options.get('SPELLING_CACHE_SIZE',
+                                                                    DEFAULT_SPELLING_CACHE_SIZE))
+        self.mlt_max_terms = connection_options.get('MLT_MAX_TERMS')
+        self.mlt_max_documents = connection_options.get('MLT_MAX_DOCUMENTS')
+        self.mlt_cache = None
+        if connection_options.get('MLT_CACHE_SIZE'):
+            self.mlt_cache = XHLRUCache(connection_options['MLT_CACHE_SIZE'])
+        self.query_facet_threads = connection_options.get('QUERY_FACET_THREADS') or DEFAULT_QUERY_FACET_THREADS
+        self.lazy_decode = connection_options.get('LAZY_DECODE', True)
+        self.exact_fields = frozenset(connection_options.get('EXACT_FIELDS', ()))
+        self.prefix_fields = frozenset(connection_options.get('PREFIX_FIELDS', ()))
+        self.multi_value_facet_fields = connection_options.get('MULTI_VALUE_FACET_FIELDS')
+        if self.multi_value_facet_fields is not None:
+            self.multi_value_facet_fields = frozenset(self.multi_value_facet_fields)
+        self.ngram_lengths = connection_options.get('NGRAM_LENGTHS', {})
+        self.ngram_skip_unprefixed = connection_options.get('NGRAM_SKIP_UNPREFIXED', False)
+        self.prefix_max_length = connection_options.get('PREFIX_MAX_LENGTH', DEFAULT_PREFIX_MAX_LENGTH)
+
+        self.wildcard_expansion_limit = connection_options.get('WILDCARD_EXPANSION_LIMIT')
+        self.wildcard_expansion_strategy = connection_options.get('WILDCARD_EXPANSION_STRATEGY', 'error')
+        if self.wildcard_expansion_strategy not in WILDCARD_EXPANSION_STRATEGIES:
+            raise ImproperlyConfigured("'WILDCARD_EXPANSION_STRATEGY' of connection '%s' must be one of %s."
+                                       % (connection_alias, ', '.join(WILDCARD_EXPANSION_STRATEGIES)))
+        if self.wildcard_expansion_strategy != 'error' and not hasattr(xapian.Query, 'OP_WILDCARD'):
+            raise ImproperlyConfigured("'WILDCARD_EXPANSION_STRATEGY' requires Xapian >= 1.4.")
+
+        self.value_encoding = connection_options.get('VALUE_ENCODING', LEGACY_VALUE_ENCODING)
+        if self.value_encoding not in VALUE_ENCODINGS:
+            raise ImproperlyConfigured("'VALUE_ENCODING' of connection '%s' must be one of %s."
+                                       % (connection_alias, ', '.join(str(e) for e in VALUE_ENCODINGS)))
+
+        self.result_cache_timeout = connection_options.get('RESULT_CACHE_TIMEOUT')
+        self.result_cache = None
+        if connection_options.get('RESULT_CACHE_SIZE'):
+            self.result_cache = XHLRUCache(connection_options['RESULT_CACHE_SIZE'], self.result_cache_timeout)
+        self.result_cache_alias = connection_options.get('RESULT_CACHE_ALIAS')
+        self.query_cache_size = connection_options.get('QUERY_CACHE_SIZE', 0)
+
+        codec = connection_options.get('STORED_DATA_CODEC', 'pickle')
+        if codec in STORED_DATA_CODECS:
+            codec = STORED_DATA_CODECS[codec]
+        elif isinstance(codec, six.string_types):
+            module_name, class_name = codec.rsplit('.', 1)
+            codec = getattr(importlib.import_module(module_name), class_name)
+        self.codec = codec(connection_options.get('STORED_DATA_COMPRESSION'))
+
+        # the search fields last seen by `_update_cache` and the
+        # schema built from them; use properties to retrieve it
+        self._fields = None
+        self._schema = None
+
+        # objects that can not be shared between threads, e.g. the query parser
+        self._local = threading.local()
+
+        # the last database revision read whose `VALUE_ENCODING` was checked
+        self._value_encoding_checked = None
 
     def _update_cache(self):
         """
-        To avoid build_schema every time, we cache
-        some values: they only change when a SearchIndex
+        To avoid build_schema every time, we cache the schema
+        as a `XHSchema`: it only changes when a SearchIndex
         changes, which typically restarts the Python.
+
+        Returns the current `XHSchema`.
         """
         fields = connections[self.connection_alias].get_unified_index().all_searchfields()
-        if self._fields != fields:
+        # the unified index builds a new dictionary whenever its indexes
+        # change, so the (costly) comparison is only done in that case.
+        if fields is not self._fields:
+            if self._schema is None or fields != self._fields:
+                version = self._schema.version + 1 if self._schema is not None else 1
+                self._schema = XHSchema(self, fields, version)
             self._fields = fields
-            self._content_field_name, self._schema = self.build_schema(self._fields)
+        return self._schema
 
     @property
     def schema(self):
-        self._update_cache()
-        return self._schema
+        return self._update_cache().fields
 
     @property
     def content_field_name(self):
-        self._update_cache()
-        return self._content_field_name
+        return self._update_cache().content_field_name
 
     @property
     def column(self):
         """
         Returns the column in the database of a given field name.
         """
-        self._update_cache()
-        return self._columns
+        return self._update_cache().columns
+
+    @property
+    def unstored_fields(self):
+        """
+        Returns the names of the fields that are not stored in the documents.
+        """
+        return self._update_cache().unstored_fields
+
+    @property
+    def indexing_plan(self):
+        """
+        Returns the plan used by `update` to index each field.
+        """
+        return self._update_cache().indexing_plan
+
+    @staticmethod
+    def _build_indexing_plan(schema, exact_fields=(), prefix_fields=(),
+                             prefix_max_length=DEFAULT_PREFIX_MAX_LENGTH, ngram_lengths=None,
+                             ngram_unprefixed=True, multi_value_faceted=None):
+        """
+        Compiles the schema into a list of tuples of the form
+        (field_name, field_type, column, prefix, handler) so that `update`
+        does not have to work out how each field is indexed for every object.
+
+        `handler` is called with (document, term_generator, termpos, prefix,
+        column, field_type, value, weight, value_encoding) and returns the
+        next term position.
+
+        The other arguments come from the `XHSchema` and the connection
+        options: the names of the fields of `EXACT_FIELDS` and `PREFIX_FIELDS`,
+        the ngram lengths of each ngram field, whether ngrams are also
+        indexed without prefix and the names of the multi valued fields whose
+        values are stored for faceting (default = all of them).
+        """
+        plan = []
+        for field in schema:
+            field_name = field['field_name']
+
+            if field_name in ('id', 'django_id', 'django_ct'):
+                # Private fields are indexed in a different way:
+                # `django_id` is an int and `django_ct` is text;
+                # besides, they are indexed by their (unstemmed) value.
+                prefix = TERM_PREFIXES[field_name]
+                handler = _index_private_field
+            else:
+                prefix = TERM_PREFIXES['field'] + field_name.upper()
+                if field['multi_valued'] == 'true':
+                    if field_name in exact_fields:
+                        handler = _index_exact_multi_valued_field
+                    else:
+                        handler = _index_multi_valued_field
+                    if multi_value_faceted is not None and field_name not in multi_value_faceted:
+                        handler = functools.partial(handler, faceted=False)
+                elif field_name in exact_fields:
+                    handler = _index_exact_text_field
+                elif field['type'] in ('ngram', 'edge_ngram'):
+                    handler = functools.partial(
+                        FIELD_INDEXERS[field['type']], unprefixed=ngram_unprefixed,
+                        ngram_lengths=(ngram_lengths or {}).get(field_name, (NGRAM_MIN_LENGTH, NGRAM_MAX_LENGTH)))
+                else:
+                    handler = FIELD_INDEXERS.get(field['type'], _index_term_field)
+
+                if field_name in prefix_fields:
+                    handler = _prefix_indexer(handler, field['multi_valued'] == 'true', prefix_max_length)
+
+            plan.append((field_name, field['type'], field['column'], prefix, handler))
+        return plan
 
     def update(self, index, iterable):
         """
@@ -258,210 +1241,83 @@ class XapianSearchBackend(BaseSearchBackend):
         This is useful for querying for a specific document corresponding to
         a model instance.
 
-        The document also contains a pickled version of the object itself and
-        the document ID in the document data field.
+        The document also contains the stored fields of the object and
+        the document ID in the document data field, encoded by the codec
+        selected by `STORED_DATA_CODEC` (by default, a pickle).
+        Fields with `stored=False` are left out.
 
         Finally, we also store field values to be used for sorting data.  We
         store these in the document value slots (position zero is reserver
         for the document ID).  All values are stored as unicode strings with
         conversion of float, int, double, values being done by Xapian itself
         through the use of the :method:xapian.sortable_serialise method.
+        Integers, dates and datetimes are stored according to `VALUE_ENCODING`,
+        which must be the encoding the database was built with.
+
+        If `BATCH_COMMIT_SIZE` is set in the connection options, documents are
+        replaced inside transactions of that many documents: each batch is
+        committed atomically and a failure only discards the current batch.
+
+        An object whose data can not be decoded is skipped and logged if
+        `SILENTLY_FAIL` is set (the default); otherwise the error is raised.
         """
-        database = self._database(writable=True)
+        rebuild = getattr(self._local, 'staging', None)
+        database = self._database(writable=True, staging=rebuild is not None)
+        value_encoding = self.value_encoding
+
+        batch_size = self.batch_commit_size
+        batch_count = 0
+        in_transaction = False
 
         try:
+            self._check_value_encoding(database)
+
             term_generator = xapian.TermGenerator()
             term_generator.set_database(database)
             term_generator.set_stemmer(xapian.Stem(self.language))
             if self.include_spelling is True:
                 term_generator.set_flags(xapian.TermGenerator.FLAG_SPELLING)
 
-            def _add_text(termpos, text, weight, prefix=''):
-                """
-                indexes text appending 2 extra terms
-                to identify beginning and ending of the text.
-                """
-                term_generator.set_termpos(termpos)
-
-                start_term = '%s^' % prefix
-                end_term = '%s$' % prefix
-                # add begin
-                document.add_posting(start_term, termpos, weight)
-                # add text
-                term_generator.index_text(text, weight, prefix)
-                termpos = term_generator.get_termpos()
-                # add ending
-                termpos += 1
-                document.add_posting(end_term, termpos, weight)
-
-                # increase termpos
-                term_generator.set_termpos(termpos)
-                term_generator.increase_termpos(TERMPOS_DISTANCE)
-
-                return term_generator.get_termpos()
-
-            def _add_literal_text(termpos, text, weight, prefix=''):
-                """
-                Adds sentence to the document with positional information
-                but without processing.
-
-                The sentence is bounded by "^" "$" to allow exact matches.
-                """
-                text = '^ %s $' % text
-                for word in text.split():
-                    term = '%s%s' % (prefix, word)
-                    document.add_posting(term, termpos, weight)
-                    termpos += 1
-                termpos += TERMPOS_DISTANCE
-                return termpos
-
-            def add_text(termpos, prefix, text, weight):
-                """
-                Adds text to the document with positional information
-                and processing (e.g. stemming).
-                """
-                termpos = _add_text(termpos, text, weight, prefix=prefix)
-                termpos = _add_text(termpos, text, weight, prefix='')
-                termpos = _add_literal_text(termpos, text, weight, prefix=prefix)
-                termpos = _add_literal_text(termpos, text, weight, prefix='')
-                return termpos
-
-            def _get_ngram_lengths(value):
-                values = value.split()
-                for item in values:
-                    for ngram_length in six.moves.range(NGRAM_MIN_LENGTH, NGRAM_MAX_LENGTH + 1):
-                        yield item, ngram_length
+            schema = self._update_cache()
+            self.codec.register_schema(database, schema)
+
+            # the plan only depends on the schema; weights depend on the index.
+            weights = index.get_field_weights()
+            plan = [entry + (int(weights.get(entry[0], 1)),) for entry in schema.indexing_plan]
+            unstored_fields = schema.unstored_fields
 
             for obj in iterable:
+                if batch_size and not in_transaction:
+                    database.begin_transaction()
+                    in_transaction = True
+
                 document = xapian.Document()
                 term_generator.set_document(document)
 
-                def ngram_terms(value):
-                    for item, length in _get_ngram_lengths(value):
-                        item_length = len(item)
-                        for start in six.moves.range(0, item_length - length + 1):
-                            for size in six.moves.range(length, length + 1):
-                                end = start + size
-                                if end > item_length:
-                                    continue
-                                yield _to_xapian_term(item[start:end])
-
-                def edge_ngram_terms(value):
-                    for item, length in _get_ngram_lengths(value):
-                        yield _to_xapian_term(item[0:length])
-
-                def add_edge_ngram_to_document(prefix, value, weight):
-                    """
-                    Splits the term in ngrams and adds each ngram to the index.
-                    The minimum and maximum size of the ngram is respectively
-                    NGRAM_MIN_LENGTH and NGRAM_MAX_LENGTH.
-                    """
-                    for term in edge_ngram_terms(value):
-                        document.add_term(term, weight)
-                        document.add_term(prefix + term, weight)
-
-                def add_ngram_to_document(prefix, value, weight):
-                    """
-                    Splits the term in ngrams and adds each ngram to the index.
-                    The minimum and maximum size of the ngram is respectively
-                    NGRAM_MIN_LENGTH and NGRAM_MAX_LENGTH.
-                    """
-                    for term in ngram_terms(value):
-                        document.add_term(term, weight)
-                        document.add_term(prefix + term, weight)
-
-                def add_non_text_to_document(prefix, term, weight):
-                    """
-                    Adds term to the document without positional information
-                    and without processing.
-
-                    If the term is alone, also adds it as "^<term>$"
-                    to allow exact matches on single terms.
-                    """
-                    document.add_term(term, weight)
-                    document.add_term(prefix + term, weight)
-
-                def add_datetime_to_document(termpos, prefix, term, weight):
-                    """
-                    Adds a datetime to document with positional order
-                    to allow exact matches on it.
-                    """
-                    date, time = term.split()
-                    document.add_posting(date, termpos, weight)
-                    termpos += 1
-                    document.add_posting(time, termpos, weight)
-                    termpos += 1
-                    document.add_posting(prefix + date, termpos, weight)
-                    termpos += 1
-                    document.add_posting(prefix + time, termpos, weight)
-                    termpos += TERMPOS_DISTANCE + 1
-                    return termpos
-
-                data = index.full_prepare(obj)
-                weights = index.get_field_weights()
-
-                termpos = term_generator.get_termpos()  # identifies the current position in the document.
-                for field in self.schema:
-                    if field['field_name'] not in list(data.keys()):
-                        # not supported fields are ignored.
-                        continue
-
-                    if field['field_name'] in weights:
-                        weight = int(weights[field['field_name']])
-                    else:
-                        weight = 1
-
-                    value = data[field['field_name']]
-
-                    if field['field_name'] in ('id', 'django_id', 'django_ct'):
-                        # Private fields are indexed in a different way:
-                        # `django_id` is an int and `django_ct` is text;
-                        # besides, they are indexed by their (unstemmed) value.
-                        if field['field_name'] == 'django_id':
-                            value = int(value)
-                        value = _term_to_xapian_value(value, field['type'])
-
-                        document.add_term(TERM_PREFIXES[field['field_name']] + value, weight)
-                        document.add_value(field['column'], value)
-                        continue
-                    else:
-                        prefix = TERM_PREFIXES['field'] + field['field_name'].upper()
-
-                        # if not multi_valued, we add as a document value
-                        # for sorting and facets
-                        if field['multi_valued'] == 'false':
-                            document.add_value(field['column'], _term_to_xapian_value(value, field['type']))
-                        else:
-                            for t in value:
-                                # add the exact match of each value
-                                term = _to_xapian_term(t)
-                                termpos = add_text(termpos, prefix, term, weight)
-                            continue
+                try:
+                    data = index.full_prepare(obj)
 
-                        term = _to_xapian_term(value)
-                        if term == '':
+                    termpos = term_generator.get_termpos()  # identifies the current position in the document.
+                    for field_name, field_type, column, prefix, handler, weight in plan:
+                        if field_name not in data:
+                            # not supported fields are ignored.
                             continue
-                        # from here on the term is a string;
-                        # we now decide how it is indexed
-
-                        if field['type'] == 'text':
-                            # text is indexed with positional information
-                            termpos = add_text(termpos, prefix, term, weight)
-                        elif field['type'] == 'datetime':
-                            termpos = add_datetime_to_document(termpos, prefix, term, weight)
-                        elif field['type'] == 'ngram':
-                            add_ngram_to_document(prefix, value, weight)
-                        elif field['type'] == 'edge_ngram':
-                            add_edge_ngram_to_document(prefix, value, weight)
-                        else:
-                            # all other terms are added without positional information
-                            add_non_text_to_document(prefix, term, weight)
-
-                # store data without indexing it
-                document.set_data(pickle.dumps(
-                    (obj._meta.app_label, obj._meta.module_name, obj.pk, data),
-                    pickle.HIGHEST_PROTOCOL
-                ))
+                        termpos = handler(document, term_generator, termpos, prefix, column, field_type,
+                                          data[field_name], weight, value_encoding)
+
+                    # store data without indexing it
+                    if unstored_fields:
+                        data = dict((field_name, value) for field_name, value in data.items()
+                                    if field_name not in unstored_fields)
+                    document.set_data(self.codec.encode(obj._meta.app_label, obj._meta.module_name, obj.pk, data,
+                                                        schema))
+                except UnicodeDecodeError:
+                    if not self.silently_fail:
+                        raise
+                    # only the object is skipped, the rest of the batch is indexed
+                    self.log.error('UnicodeDecodeError while preparing object for update', exc_info=True,
+                                   extra={'data': {'index': index, 'object': get_identifier(obj)}})
+                    continue
 
                 # add the id of the document
                 document_id = TERM_PREFIXES['id'] + get_identifier(obj)
@@ -470,12 +1326,31 @@ class XapianSearchBackend(BaseSearchBackend):
                 # finally, replace or add the document to the database
                 database.replace_document(document_id, document)
 
-        except UnicodeDecodeError:
-            sys.stderr.write('Chunk failed.\n')
-            pass
+                if in_transaction:
+                    batch_count += 1
+                    if batch_count >= batch_size:
+                        database.commit_transaction()
+                        in_transaction = False
+                        batch_count = 0
+
+            if in_transaction:
+                database.commit_transaction()
+                in_transaction = False
+
+            if rebuild is not None:
+                rebuild['updated'] = True
+
+        except Exception:
+            if rebuild is not None:
+                # the staging database misses documents and is never published
+                rebuild['failed'] = True
+            raise
 
         finally:
+            if in_transaction:
+                database.cancel_transaction()
             database.close()
+            self.reader_pool.modified()
 
     def remove(self, obj):
         """
@@ -487,6 +1362,7 @@ class XapianSearchBackend(BaseSearchBackend):
         database = self._database(writable=True)
         database.delete_document(TERM_PREFIXES['id'] + get_identifier(obj))
         database.close()
+        self.reader_pool.modified()
 
     def clear(self, models=(), commit=True):
         """
@@ -502,18 +1378,176 @@ class XapianSearchBackend(BaseSearchBackend):
         Otherwise, for each model, a `delete_document` call is issued with
         the term `XCONTENTTYPE<app_name>.<model_name>`.  This will delete
         all documents with the specified model type.
-        """
-        if not models:
+
+        If `STAGED_REBUILD` is set in the connection options, clearing all
+        models instead starts an empty staging database next to `PATH`:
+        readers keep using the database in `PATH` while the following calls
+        to `update` made by the same thread go to the staging database, until
+        `publish` is called by that thread. Other writes, e.g. `remove` or
+        updates made by other threads or processes, still go to `PATH`.
+        A staging database that is not published is discarded by the next
+        staged `clear`.
+        """
+        if not models and self.staged_rebuild and self.path != MEMORY_DB_NAME:
+            staging_path = self._staging_path()
+            if os.path.exists(staging_path):
+                shutil.rmtree(staging_path)
+            xapian.WritableDatabase(staging_path, xapian.DB_CREATE_OR_OPEN).close()
+            # whether an update to the staging database succeeded or failed
+            self._local.staging = {'updated': False, 'failed': False}
+        elif not models:
             # Because there does not appear to be a "clear all" method,
             # it's much quicker to remove the contents of the `self.path`
             # folder than it is to remove each document one at a time.
             if os.path.exists(self.path):
-                shutil.rmtree(self.path)
+                self._remove_directory(self.path)
+            self.reader_pool.replaced()
         else:
             database = self._database(writable=True)
             for model in models:
                 database.delete_document(TERM_PREFIXES['django_ct'] + get_model_ct(model))
             database.close()
+            self.reader_pool.modified()
+
+    def publish(self):
+        """
+        Replaces the database in `PATH` by the staging database started by
+        `clear` in the current thread when `STAGED_REBUILD` is set.
+
+        The staging database is only published if at least one of its updates
+        succeeded and none failed, so that neither a rebuild that indexed
+        nothing (e.g. `clear_index` on its own) nor a partial one replaces `PATH`.
+
+        Returns `True` if a staging database was published, `False` if the
+        thread did not start one. Raises `InvalidIndexError` if it is not
+        complete; it is then discarded by the next `clear`.
+        """
+        rebuild = getattr(self._local, 'staging', None)
+        self._local.staging = None
+        if rebuild is None or not os.path.isdir(self._staging_path()):
+            return False
+        if rebuild['failed'] or not rebuild['updated']:
+            raise InvalidIndexError('The staging database "%s" was not completed by its rebuild; '
+                                    'rebuild the index again.' % self._staging_path())
+
+        # the staging path is reused by the next rebuild, so the database
+        # is moved to a path of its own before being published.
+        new_path = self._sibling_path('live')
+        os.rmdir(new_path)
+        os.rename(self._staging_path(), new_path)
+        self._publish(new_path)
+        return True
+
+    def parallel_rebuild(self, index=None, queryset=None, processes=None):
+        """
+        Rebuilds the database from scratch using a pool of processes.
+
+        Optional arguments:
+            `index` -- The only `SearchIndex` to rebuild (default = every index
+                       of the unified index)
+            `queryset` -- The objects of `index` to index (default = `index.index_queryset()`)
+            `processes` -- The number of worker processes (default = number of CPUs)
+
+        Xapian only allows one writer per database, so the primary keys of
+        each queryset are split in contiguous ranges, one per process, and
+        each range is indexed with `update` into a temporary shard.
+        The ranges are bounded by the primary keys found at evenly spaced
+        offsets of the queryset, so that the keys are not loaded at once.
+        The shards are then merged with Xapian's compactor and the merged
+        database replaces the one in `PATH` (see `_publish`). If a process
+        fails, its error is raised and `PATH` is left unchanged.
+
+        Since the merged database replaces the whole of `PATH`, rebuilding a
+        single `index` raises `InvalidIndexError` if `PATH` contains documents
+        of other models, which would be lost.
+
+        The workers are forked, so that they inherit the search indexes of the
+        parent as they are; it raises `NotImplementedError` on platforms
+        without `fork`. The connections of the parent to database servers
+        are closed before forking, except inside a transaction, and the
+        workers open their own.
+        """
+        if index is None:
+            unified_index = connections[self.connection_alias].get_unified_index()
+            work = [(model_index, model_index.index_queryset())
+                    for model_index in unified_index.get_indexes().values()]
+        else:
+            if queryset is None:
+                queryset = index.index_queryset()
+            self._check_single_model(queryset.model)
+            work = [(index, queryset)]
+
+        if self.path == MEMORY_DB_NAME:
+            self.clear()
+            for index, queryset in work:
+                self.update(index, queryset)
+            return
+
+        if not hasattr(os, 'fork'):
+            raise NotImplementedError('parallel_rebuild requires the fork start method of multiprocessing.')
+
+        processes = processes or multiprocessing.cpu_count()
+        ranges = []
+        for _, queryset in work:
+            pks = queryset.order_by('pk').values_list('pk', flat=True)
+            total = pks.count()
+            chunk_size = max(int(math.ceil(total / float(processes))), 1)
+            # each range starts at the first pk of its chunk and ends before the next range
+            first_pks = [pks[start] for start in six.moves.range(0, total, chunk_size)]
+            ranges.extend((queryset, pk_range) for pk_range in zip(first_pks, first_pks[1:] + [None]))
+
+        shards = []
+        try:
+            tasks = []
+            for queryset, pk_range in ranges:
+                shards.append(self._sibling_path('shard'))
+                tasks.append((self.__class__, self.connection_alias, shards[-1], queryset.model, queryset.query,
+                              pk_range))
+            if tasks:
+                # forked workers must not share the connections of the parent
+                for connection in db_connections.all():
+                    if connection.vendor != 'sqlite' and not connection.in_atomic_block:
+                        connection.close()
+
+                context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') \
+                    else multiprocessing
+                pool = context.Pool(min(processes, len(tasks)), _init_shard_worker)
+                try:
+                    pool.map(_update_shard, tasks)
+                except BaseException:
+                    pool.terminate()
+                    raise
+                else:
+                    pool.close()
+                finally:
+                    pool.join()
+
+            destination = self._sibling_path('rebuild')
+            self._compact(shards, destination)
+        finally:
+            for shard in shards:
+                shutil.rmtree(shard, ignore_errors=True)
+
+        self._publish(destination)
+
+    def _check_single_model(self, model):
+        """
+        Private method that raises `InvalidIndexError` if the database in
+        `PATH` contains documents of other models than `model`.
+        """
+        try:
+            database = self._database()
+        except InvalidIndexError:
+            return
+
+        prefix = TERM_PREFIXES['django_ct']
+        model_ct = get_model_ct(model)
+        for item in database.allterms(prefix):
+            term = item.term.decode('utf-8') if isinstance(item.term, six.binary_type) else item.term
+            if term[len(prefix):] != model_ct:
+                raise InvalidIndexError('The index in "%s" contains documents of "%s", which a parallel rebuild '
+                                        'of "%s" alone would delete; rebuild every index instead.'
+                                        % (self.path, term[len(prefix):], model_ct))
 
     def document_count(self):
         try:
@@ -531,7 +1565,7 @@ class XapianSearchBackend(BaseSearchBackend):
                             for model_ct in registered_models_ct]
             limit_query = xapian.Query(xapian.Query.OP_OR, restrictions)
 
-            query = xapian.Query(xapian.Query.OP_AND, query, limit_query)
+            query = xapian.Query(xapian.Query.OP_FILTER, query, limit_query)
 
         return query
 
@@ -551,7 +1585,7 @@ class XapianSearchBackend(BaseSearchBackend):
     def search(self, query, sort_by=None, start_offset=0, end_offset=None,
                fields='', highlight=False, facets=None, date_facets=None,
                query_facets=None, narrow_queries=None, spelling_query=None,
-               limit_to_registered_models=True, result_class=None, **kwargs):
+               limit_to_registered_models=True, result_class=None, boolean_query=False, **kwargs):
         """
         Executes the Xapian::query as defined in `query`.
 
@@ -562,7 +1596,7 @@ class XapianSearchBackend(BaseSearchBackend):
             `sort_by` -- Sort results by specified field (default = None)
             `start_offset` -- Slice results from `start_offset` (default = 0)
             `end_offset` -- Slice results at `end_offset` (default = None), if None, then all documents
-            `fields` -- Filter results on `fields` (default = '')
+            `fields` -- Only set `fields` on the results (default = '', all fields)
             `highlight` -- Highlight terms in results (default = False)
             `facets` -- Facet results on fields (default = None)
             `date_facets` -- Facet results on date ranges (default = None)
@@ -571,11 +1605,14 @@ class XapianSearchBackend(BaseSearchBackend):
             `spelling_query` -- An optional query to execute spelling suggestion on
             `limit_to_registered_models` -- Limit returned results to models registered in
             the current `SearchSite` (default = True)
+            `boolean_query` -- `query` has no text part, so the results are not ranked:
+            they are ordered by `sort_by` or by document id (default = False)
 
         Returns:
             A dictionary with the following keys:
                 `results` -- A list of `SearchResult`
-                `hits` -- The total available results
+                `hits` -- The total available results, see `HIT_COUNT_MODE`
+                `hits_bounds` -- A tuple with the lower and upper bounds of `hits`
                 `facets` - A dictionary of facets with the following keys:
                     `fields` -- A list of field facets
                     `dates` -- A list of date facets
@@ -604,23 +1641,30 @@ class XapianSearchBackend(BaseSearchBackend):
         if result_class is None:
             result_class = SearchResult
 
-        if self.include_spelling is True:
-            spelling_suggestion = self._do_spelling_suggestion(database, query, spelling_query)
-        else:
-            spelling_suggestion = ''
+        cache_key = self._get_result_cache_key(
+            database, query, sort_by, start_offset, end_offset, fields, highlight, facets,
+            date_facets, query_facets, narrow_queries, spelling_query,
+            limit_to_registered_models, result_class, boolean_query)
+        if cache_key is not None:
+            response = self._get_cached_response(cache_key, result_class)
+            if response is not None:
+                return response
 
-        if narrow_queries is not None:
-            query = xapian.Query(
-                xapian.Query.OP_AND, query, xapian.Query(
-                    xapian.Query.OP_AND, [self.parse_query(narrow_query) for narrow_query in narrow_queries]
-                )
-            )
+        # without `end_offset`, results are fetched lazily (see `XHSearchResults`)
+        lazy = not end_offset and self.results_window_size
+        if lazy:
+            self.reader_pool.pin()
 
-        if limit_to_registered_models:
-            query = self._build_models_query(query)
+        # spelling is suggested for the query before it is narrowed
+        spelling_source_query = query
+        query = self._narrow_query(query, narrow_queries, limit_to_registered_models)
 
         enquire = xapian.Enquire(database)
-        if hasattr(settings, 'HAYSTACK_XAPIAN_WEIGHTING_SCHEME'):
+        if boolean_query:
+            # all matches would weigh the same; with BoolWeight they are
+            # in document id order unless sorted.
+            enquire.set_weighting_scheme(xapian.BoolWeight())
+        elif hasattr(settings, 'HAYSTACK_XAPIAN_WEIGHTING_SCHEME'):
             enquire.set_weighting_scheme(xapian.BM25Weight(*settings.HAYSTACK_XAPIAN_WEIGHTING_SCHEME))
         enquire.set_query(query)
 
@@ -635,60 +1679,258 @@ class XapianSearchBackend(BaseSearchBackend):
                     reverse = False  # Reverse is inverted in Xapian -- http://trac.xapian.org/ticket/311
                 sorter.add(self.column[sort_field], reverse)
 
-            enquire.set_sort_by_key_then_relevance(sorter, True)
+            if boolean_query:
+                enquire.set_sort_by_key(sorter, True)
+            else:
+                enquire.set_sort_by_key_then_relevance(sorter, True)
 
-        results = []
         facets_dict = {
             'fields': {},
             'dates': {},
             'queries': {},
         }
 
-        if not end_offset:
+        if lazy:
+            end_offset = self.results_window_size
+        elif not end_offset:
             end_offset = database.get_doccount() - start_offset
 
         ## prepare spies in case of facets
         if facets:
-            facets_spies = self._prepare_facet_field_spies(facets)
+            facets_spies = self._prepare_facet_field_spies(database, facets)
             for spy in facets_spies:
-                enquire.add_matchspy(spy)
+                for matchspy in getattr(spy, 'spies', [spy]):
+                    enquire.add_matchspy(matchspy)
 
-        matches = self._get_enquire_mset(database, enquire, start_offset, end_offset)
+        if date_facets:
+            date_facets_spies = self._prepare_facet_field_spies(database, date_facets)
+            for spy in date_facets_spies:
+                for matchspy in getattr(spy, 'spies', [spy]):
+                    enquire.add_matchspy(matchspy)
+
+        check_at_least = self._get_check_at_least(database)
+        if (facets or date_facets) and self.facet_check_at_least is not None and self.hit_count_mode != 'exact':
+            # 'exact' hit counts need the whole match checked anyway
+            check_at_least = self.facet_check_at_least
+
+        matches = self._get_enquire_mset(database, enquire, start_offset, end_offset, check_at_least)
+        # the spies already observed the match; fetching more results must not feed them.
+        enquire.clear_matchspies()
+
+        hits = self._get_hit_count(matches)
+        if cache_key is None:
+            results = self._get_results(database, enquire, matches, start_offset, lazy,
+                                        result_class, query if highlight else None, fields)
+        else:
+            # the cache keeps the data of the results, not the results
+            load = self._get_result_loader(database, matches, query if highlight else None, fields)
+            rows = [load(self._get_document_data(database, match.document)) + (match.percent,)
+                    for match in matches]
+            results = self._results_from_rows(result_class, rows)
 
-        for match in matches:
-            app_label, module_name, pk, model_data = pickle.loads(self._get_document_data(database, match.document))
-            if highlight:
-                model_data['highlighted'] = {
-                    self.content_field_name: self._do_highlight(
-                        model_data.get(self.content_field_name), query
-                    )
-                }
-            results.append(
-                result_class(app_label, module_name, pk, match.percent, **model_data)
-            )
+        spelling_suggestion = ''
+        if self.include_spelling is True and (self.spelling_max_hits is None or hits <= self.spelling_max_hits):
+            spelling_suggestion = self._do_spelling_suggestion(database, spelling_source_query, spelling_query)
 
         if facets:
-            # pick single valued facets from spies
-            single_facets_dict = self._process_facet_field_spies(facets_spies)
-
-            # pick multivalued valued facets from results
-            multi_facets_dict = self._do_multivalued_field_facets(results, facets)
-
-            # merge both results (http://stackoverflow.com/a/38990/931303)
-            facets_dict['fields'] = dict(list(single_facets_dict.items()) + list(multi_facets_dict.items()))
+            facets_dict['fields'] = self._process_facet_field_spies(facets_spies)
 
         if date_facets:
-            facets_dict['dates'] = self._do_date_facets(results, date_facets)
+            facets_dict['dates'] = self._do_date_facets(date_facets_spies, date_facets, self.value_encoding)
 
         if query_facets:
-            facets_dict['queries'] = self._do_query_facets(results, query_facets)
+            facets_dict['queries'] = self._do_query_facets(query, query_facets)
 
-        return {
+        response = {
             'results': results,
-            'hits': self._get_hit_count(database, enquire),
+            'hits': hits,
+            'hits_bounds': (matches.get_matches_lower_bound(), matches.get_matches_upper_bound()),
             'facets': facets_dict,
             'spelling_suggestion': spelling_suggestion,
         }
+        if cache_key is not None:
+            self._set_cached_response(cache_key, response, rows)
+        return response
+
+    @log_query
+    def count(self, query, narrow_queries=None, limit_to_registered_models=True, **kwargs):
+        """
+        Returns the number of documents matching the Xapian::query `query`,
+        computed according to `COUNT_MODE`, without loading any of them.
+
+        Required arguments:
+            `query` -- Search query to count
+
+        Optional arguments:
+            `narrow_queries` -- Narrow queries (default = None)
+            `limit_to_registered_models` -- Limit the count to models registered in
+            the current `SearchSite` (default = True)
+
+        Other arguments of `search` are accepted and ignored. Counts are
+        cached by database revision in up to `COUNT_CACHE_SIZE` entries.
+        """
+        if xapian.Query.empty(query):
+            return 0
+
+        database = self._database()
+
+        cache_key = None
+        version = None
+        if self.count_cache is not None and self.path != MEMORY_DB_NAME:
+            version = _get_version(database)
+        if version is not None:
+            cache_key = version + (self.count_mode, query.get_description(),
+                                   _freeze(narrow_queries), limit_to_registered_models)
+            count = self.count_cache.get(cache_key)
+            if count is not None:
+                return count
+
+        enquire = xapian.Enquire(database)
+        enquire.set_query(self._narrow_query(query, narrow_queries, limit_to_registered_models))
+        # documents are not ranked, only counted
+        enquire.set_weighting_scheme(xapian.BoolWeight())
+        matches = self._get_enquire_mset(database, enquire, 0, 0,
+                                         self._get_check_at_least(database, self.count_mode))
+        count = self._get_hit_count(matches, self.count_mode)
+
+        if cache_key is not None:
+            self.count_cache.set(cache_key, count)
+        return count
+
+    def _get_similar_terms(self, database, identifier):
+        """
+        Returns the terms that best describe the document `identifier`
+        (its ESet), or None if it is not indexed.
+
+        At most `MLT_MAX_TERMS` terms are returned (by default, as many as
+        the document has) and they are cached by database revision in up to
+        `MLT_CACHE_SIZE` entries.
+        """
+        cache_key = None
+        version = None
+        if self.mlt_cache is not None and self.path != MEMORY_DB_NAME:
+            version = _get_version(database)
+        if version is not None:
+            cache_key = version + (identifier, self.mlt_max_terms)
+            terms = self.mlt_cache.get(cache_key)
+            if terms is not None:
+                return terms
+
+        # the document is found through the postlist of its unique term
+        docid = None
+        for item in database.postlist(TERM_PREFIXES['id'] + identifier):
+            docid = item.docid
+            break
+        if docid is None:
+            return None
+
+        rset = xapian.RSet()
+        rset.add_document(docid)
+
+        max_terms = self.mlt_max_terms
+        if max_terms is None:
+            max_terms = database.get_document(docid).termlist_count()
+
+        enquire = xapian.Enquire(database)
+        terms = [expand.term for expand in enquire.get_eset(max_terms, rset, XHExpandDecider())]
+
+        if cache_key is not None:
+            self.mlt_cache.set(cache_key, terms)
+        return terms
+
+    def _narrow_query(self, query, narrow_queries, limit_to_registered_models):
+        """
+        Returns `query` restricted to the documents matching all `narrow_queries`
+        and, if `limit_to_registered_models`, to the registered models.
+        """
+        if narrow_queries is not None:
+            query = xapian.Query(
+                xapian.Query.OP_FILTER, query, xapian.Query(
+                    xapian.Query.OP_AND, [self.parse_query(narrow_query) for narrow_query in narrow_queries]
+                )
+            )
+
+        if limit_to_registered_models:
+            query = self._build_models_query(query)
+
+        return query
+
+    def _get_result_cache_key(self, database, query, *args):
+        """
+        Returns the key of the results of searching `query` on `database`
+        with the other arguments of `search` in `args`, or None if they must
+        not be cached.
+
+        The key contains the revision of the database, so that any commit
+        makes the previously cached results unreachable. Without revisions
+        (Xapian < 1.4), results are not cached.
+        """
+        if self.result_cache is None and not self.result_cache_alias:
+            return None
+        if self.path == MEMORY_DB_NAME:
+            return None
+        version = _get_version(database)
+        if version is None:
+            return None
+
+        end_offset = args[2]
+        if not end_offset and self.results_window_size:
+            # lazy results hold the database and can not be cached
+            return None
+
+        key = (self.path,) + version + (query.get_description(), _freeze(args))
+        return 'xapian:%s' % hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _get_cached_response(self, key, result_class):
+        """
+        Returns the cached response of `key`, looking up the in-process
+        cache first and the Django cache `RESULT_CACHE_ALIAS` then.
+
+        The response is a copy with new instances of `result_class`,
+        so that callers may modify it and its results.
+        """
+        response = None
+        if self.result_cache is not None:
+            response = self.result_cache.get(key)
+
+        if response is None and self.result_cache_alias:
+            response = _get_django_cache(self.result_cache_alias).get(key)
+            if response is not None and self.result_cache is not None:
+                self.result_cache.set(key, response)
+
+        if response is None:
+            return None
+        response = copy.deepcopy(response)
+        response['results'] = self._results_from_rows(result_class, response.pop('rows'))
+        return response
+
+    def _set_cached_response(self, key, response, rows):
+        """
+        Caches a copy of `response` under `key`, with the data of its
+        results, `rows`, in place of the results themselves, for
+        `RESULT_CACHE_TIMEOUT` seconds in both caches.
+        """
+        response = dict((name, value) for name, value in response.items() if name != 'results')
+        response['rows'] = rows
+        response = copy.deepcopy(response)
+        if self.result_cache is not None:
+            self.result_cache.set(key, response)
+        if self.result_cache_alias:
+            cache = _get_django_cache(self.result_cache_alias)
+            if self.result_cache_timeout is None:
+                # `None` would keep the response forever: use the timeout of the cache
+                cache.set(key, response)
+            else:
+                cache.set(key, response, self.result_cache_timeout)
+
+    @staticmethod
+    def _results_from_rows(result_class, rows):
+        """
+        Returns a list of `result_class` built from `rows`, a list of
+        tuples (app_label, module_name, pk, model_data, score).
+        """
+        return [result_class(app_label, module_name, pk, score, **model_data)
+                for app_label, module_name, pk, model_data, score in rows]
 
     def more_like_this(self, model_instance, additional_query=None,
                        start_offset=0, end_offset=None,
@@ -709,53 +1951,52 @@ class XapianSearchBackend(BaseSearchBackend):
         Returns:
             A dictionary with the following keys:
                 `results` -- A list of `SearchResult`
-                `hits` -- The total available results
+                `hits` -- The total available results, see `HIT_COUNT_MODE`
+                `hits_bounds` -- A tuple with the lower and upper bounds of `hits`
 
-        Opens a database connection, then builds a simple query using the
-        `model_instance` to build the unique identifier.
+        Opens a database connection, then looks up the document of
+        `model_instance` by its unique identifier term.
 
-        For each document retrieved(should always be one), adds an entry into
-        an RSet (relevance set) with the document id, then, uses the RSet
+        Adds the document to an RSet (relevance set), then, uses the RSet
         to query for an ESet (A set of terms that can be used to suggest
-        expansions to the original query), omitting any document that was in
-        the original query.
+        expansions to the original query), omitting the document itself,
+        see `_get_similar_terms`.
 
-        Finally, processes the resulting matches and returns.
+        Finally, processes the resulting matches, at most the first
+        `MLT_MAX_DOCUMENTS` of them if set, and returns.
         """
         database = self._database()
 
         if result_class is None:
             result_class = SearchResult
 
-        query = xapian.Query(TERM_PREFIXES['id'] + get_identifier(model_instance))
-
-        enquire = xapian.Enquire(database)
-        enquire.set_query(query)
-
-        rset = xapian.RSet()
-
-        if not end_offset:
+        identifier = get_identifier(model_instance)
+
+        # without `end_offset`, results are fetched lazily (see `XHSearchResults`)
+        lazy = not end_offset and self.results_window_size
+        if self.mlt_max_documents is not None:
+            # only the `MLT_MAX_DOCUMENTS` most similar documents are returned
+            lazy = False
+            end_offset = max(min(end_offset or self.mlt_max_documents,
+                                 self.mlt_max_documents - start_offset), 0)
+        elif lazy:
+            self.reader_pool.pin()
+            end_offset = self.results_window_size
+        elif not end_offset:
             end_offset = database.get_doccount()
 
-        match = None
-        for match in self._get_enquire_mset(database, enquire, 0, end_offset):
-            rset.add_document(match.docid)
-
-        if match is None:
+        terms = self._get_similar_terms(database, identifier)
+        if terms is None:
             if not self.silently_fail:
                 raise InvalidIndexError('Instance %s with id "%d" not indexed' %
-                                        (get_identifier(model_instance), model_instance.id))
+                                        (identifier, model_instance.id))
             else:
                 return {'results': [],
                         'hits': 0}
 
+        query = xapian.Query(xapian.Query.OP_ELITE_SET, terms, len(terms))
         query = xapian.Query(
-            xapian.Query.OP_ELITE_SET,
-            [expand.term for expand in enquire.get_eset(match.document.termlist_count(), rset, XHExpandDecider())],
-            match.document.termlist_count()
-        )
-        query = xapian.Query(
-            xapian.Query.OP_AND_NOT, [query, TERM_PREFIXES['id'] + get_identifier(model_instance)]
+            xapian.Query.OP_AND_NOT, [query, TERM_PREFIXES['id'] + identifier]
         )
 
         if limit_to_registered_models:
@@ -766,20 +2007,27 @@ class XapianSearchBackend(BaseSearchBackend):
                 xapian.Query.OP_AND, query, additional_query
             )
 
+        enquire = xapian.Enquire(database)
         enquire.set_query(query)
 
-        results = []
-        matches = self._get_enquire_mset(database, enquire, start_offset, end_offset)
+        check_at_least = self._get_check_at_least(database)
+        if self.mlt_max_documents is not None:
+            check_at_least = min(check_at_least, self.mlt_max_documents)
 
-        for match in matches:
-            app_label, module_name, pk, model_data = pickle.loads(self._get_document_data(database, match.document))
-            results.append(
-                result_class(app_label, module_name, pk, match.percent, **model_data)
-            )
+        matches = self._get_enquire_mset(database, enquire, start_offset, end_offset, check_at_least)
+
+        hits = self._get_hit_count(matches)
+        hits_bounds = (matches.get_matches_lower_bound(), matches.get_matches_upper_bound())
+        if self.mlt_max_documents is not None:
+            hits = min(hits, self.mlt_max_documents)
+            hits_bounds = tuple(min(bound, self.mlt_max_documents) for bound in hits_bounds)
+
+        results = self._get_results(database, enquire, matches, start_offset, lazy, result_class)
 
         return {
             'results': results,
-            'hits': self._get_hit_count(database, enquire),
+            'hits': hits,
+            'hits_bounds': hits_bounds,
             'facets': {
                 'fields': {},
                 'dates': {},
@@ -788,6 +2036,117 @@ class XapianSearchBackend(BaseSearchBackend):
             'spelling_suggestion': None,
         }
 
+    def _get_results(self, database, enquire, matches, start_offset, lazy,
+                     result_class, highlight_query=None, fields=None):
+        """
+        Private method that returns the results of a search.
+
+        Required arguments:
+            `database` -- The database that was queried
+            `enquire` -- The enquire instance of the search
+            `matches` -- The mset of the search, starting at `start_offset`
+            `start_offset` -- The offset of the first result
+            `lazy` -- Whether to return a `XHSearchResults` instead of a list,
+                      in which case `database` must be pinned (see `XHReaderPool.pin`)
+            `result_class` -- The class of each result
+
+        Optional arguments:
+            `highlight_query` -- If not None, the query to highlight in the content field
+            `fields` -- If not empty, the only stored fields set on each result
+
+        Returns a list, or a `XHSearchResults` if `lazy`, of `result_class`.
+
+        If `LAZY_DECODE` is set in the connection options (the default) and
+        `result_class` is a `SearchResult`, the stored data of each document
+        is only decoded when an attribute of its result is first accessed.
+        """
+        load = self._get_result_loader(database, matches, highlight_query, fields)
+
+        lazy_class = None
+        if self.lazy_decode and isinstance(result_class, type) and issubclass(result_class, SearchResult):
+            lazy_class = _lazy_result_class(result_class)
+
+        def make_result(match):
+            data = self._get_document_data(database, match.document)
+            if lazy_class is not None:
+                return lazy_class(data, match.percent, load)
+            app_label, module_name, pk, model_data = load(data)
+            return result_class(app_label, module_name, pk, match.percent, **model_data)
+
+        if lazy:
+            length = None
+            if matches.get_matches_lower_bound() == matches.get_matches_upper_bound():
+                length = matches.get_matches_lower_bound() - start_offset
+            return XHSearchResults(database, enquire, start_offset, length,
+                                   self.results_window_size, make_result, matches)
+        return [make_result(match) for match in matches]
+
+    def _get_result_loader(self, database, matches, highlight_query=None, fields=None):
+        """
+        Private method that returns a function decoding the stored data of a
+        document of `matches` into a tuple (app_label, module_name, pk, model_data).
+
+        Required arguments:
+            `database` -- The database searched
+            `matches` -- The mset of the search
+
+        Optional arguments:
+            `highlight_query` -- If not None, the query to highlight in the content field
+            `fields` -- If not empty, the only stored fields set in `model_data`
+        """
+        if isinstance(fields, six.string_types):
+            fields = fields.split()
+        fields = set(fields or ())
+
+        decoded_fields = fields
+        if fields and highlight_query is not None:
+            decoded_fields = fields | set([self.content_field_name])
+
+        highlighter = None
+        if highlight_query is not None:
+            highlighter = XHHighlighter(highlight_query, matches=matches,
+                                        snippet_length=self.highlight_snippet_length, language=self.language,
+                                        prefixes=self._update_cache().prefixes.values())
+
+        get_field_names = self._get_stored_field_names(database)
+
+        def load(data):
+            app_label, module_name, pk, model_data = self.codec.decode(data, decoded_fields, get_field_names)
+            if highlighter is not None:
+                model_data['highlighted'] = {
+                    self.content_field_name: highlighter.highlight(model_data.get(self.content_field_name))
+                }
+            if fields:
+                model_data = dict((field, value) for field, value in model_data.items()
+                                  if field in fields or field == 'highlighted')
+            return app_label, module_name, pk, model_data
+
+        return load
+
+    def _get_stored_field_names(self, database):
+        """
+        Private method that returns a function returning the `stored_field_names`
+        of the schema of a fingerprint (see `XHSchema`): those of the current
+        schema, or those recorded in the metadata of `database` by `update`.
+        """
+        schema = self._update_cache()
+
+        def get_field_names(fingerprint):
+            if fingerprint == schema.fingerprint:
+                return schema.stored_field_names
+            field_names = _stored_field_names.get(fingerprint)
+            if field_names is None:
+                metadata = database.get_metadata(STORED_FIELDS_METADATA_KEY % fingerprint)
+                if not metadata:
+                    return None
+                if isinstance(metadata, six.binary_type):
+                    metadata = metadata.decode('utf-8')
+                # the names of a fingerprint never change, so they are kept
+                field_names = _stored_field_names[fingerprint] = tuple(metadata.split('\n'))
+            return field_names
+
+        return get_field_names
+
     def parse_query(self, query_string):
         """
         Given a `query_string`, will attempt to return a xapian.Query
@@ -802,28 +2161,81 @@ class XapianSearchBackend(BaseSearchBackend):
         elif query_string == '':
             return xapian.Query()  # Match nothing
 
-        qp = xapian.QueryParser()
-        qp.set_database(self._database())
-        qp.set_stemmer(xapian.Stem(self.language))
-        qp.set_stemming_strategy(xapian.QueryParser.STEM_SOME)
-        qp.set_default_op(XAPIAN_OPTS[DEFAULT_OPERATOR])
-        qp.add_boolean_prefix('django_ct', TERM_PREFIXES['django_ct'])
-
-        for field_dict in self.schema:
-            # since 'django_ct' has a boolean_prefix,
-            # we ignore it here.
-            if field_dict['field_name'] == 'django_ct':
-                continue
+        qp, database = self._get_query_parser()
+
+        version = None
+        if self.query_cache_size and self.path != MEMORY_DB_NAME:
+            version = _get_version(database)
+        if version is None:
+            return qp.parse_query(query_string, self.flags)
+
+        # Xapian queries can not be shared between threads, so each one has its cache
+        cache = getattr(self._local, 'query_cache', None)
+        if cache is None:
+            cache = self._local.query_cache = XHLRUCache(self.query_cache_size)
+
+        # parsing depends on the terms of the database, e.g. to expand wildcards
+        key = (query_string, self.flags, self._schema.version) + version
+        query = cache.get(key)
+        if query is None:
+            query = qp.parse_query(query_string, self.flags)
+            cache.set(key, query)
+        return query
 
-            qp.add_prefix(
-                field_dict['field_name'],
-                TERM_PREFIXES['field'] + field_dict['field_name'].upper()
-            )
+    def _get_wildcard_limit_type(self):
+        """
+        Returns the Xapian constant of `WILDCARD_EXPANSION_STRATEGY`.
+        """
+        return getattr(xapian.Query, 'WILDCARD_LIMIT_%s' % self.wildcard_expansion_strategy.upper())
 
-        vrp = XHValueRangeProcessor(self)
-        qp.add_valuerangeprocessor(vrp)
+    def _get_query_parser(self):
+        """
+        Returns a tuple (query_parser, database) with the query parser of the
+        current thread, set to the database searched by it.
+
+        The query parser is configured once per thread and only configured
+        again when the schema changes.
+        """
+        schema = self._update_cache()
+        local = self._local
+
+        qp = getattr(local, 'query_parser', None)
+        if qp is None or local.query_parser_version != schema.version:
+            qp = xapian.QueryParser()
+            qp.set_stemmer(xapian.Stem(self.language))
+            qp.set_stemming_strategy(xapian.QueryParser.STEM_SOME)
+            qp.set_default_op(XAPIAN_OPTS[DEFAULT_OPERATOR])
+            qp.add_boolean_prefix('django_ct', TERM_PREFIXES['django_ct'])
 
-        return qp.parse_query(query_string, self.flags)
+            for field_name, prefix in schema.prefixes.items():
+                # since 'django_ct' has a boolean_prefix,
+                # we ignore it here.
+                if field_name == 'django_ct':
+                    continue
+
+                qp.add_prefix(field_name, prefix)
+
+            # the processor must live as long as the query parser
+            local.value_range_processor = XHValueRangeProcessor(self)
+            qp.add_valuerangeprocessor(local.value_range_processor)
+
+            if self.wildcard_expansion_limit:
+                if hasattr(qp, 'set_max_expansion'):
+                    qp.set_max_expansion(self.wildcard_expansion_limit, self._get_wildcard_limit_type())
+                else:
+                    qp.set_max_wildcard_expansion(self.wildcard_expansion_limit)
+
+            local.query_parser = qp
+            local.query_parser_version = schema.version
+            local.query_parser_database = None
+            local.query_cache = None
+
+        database = self._database()
+        if local.query_parser_database is not database:
+            qp.set_database(database)
+            local.query_parser_database = database
+
+        return qp, database
 
     def build_schema(self, fields):
         """
@@ -855,10 +2267,6 @@ class XapianSearchBackend(BaseSearchBackend):
              'multi_valued': 'false',
              'column': 2},
         ]
-        self._columns[ID] = 0
-        self._columns[DJANGO_ID] = 1
-        self._columns[DJANGO_CT] = 2
-
         column = len(schema_fields)
 
         for field_name, field_class in sorted(list(fields.items()), key=lambda n: n[0]):
@@ -892,42 +2300,30 @@ class XapianSearchBackend(BaseSearchBackend):
                     field_data['multi_valued'] = 'true'
 
                 schema_fields.append(field_data)
-                self._columns[field_data['field_name']] = column
                 column += 1
 
         return content_field_name, schema_fields
 
-    @staticmethod
-    def _do_highlight(content, query, tag='em'):
-        """
-        Highlight `query` terms in `content` with html `tag`.
-
-        This method assumes that the input text (`content`) does not contain
-        any special formatting.  That is, it does not contain any html tags
-        or similar markup that could be screwed up by the highlighting.
-
-        Required arguments:
-            `content` -- Content to search for instances of `text`
-            `text` -- The text to be highlighted
-        """
-        for term in query:
-            for match in re.findall('[^A-Z]+', term):  # Ignore field identifiers
-                match_re = re.compile(match, re.I)
-                content = match_re.sub('<%s>%s</%s>' % (tag, term, tag), content)
-
-        return content
-
-    def _prepare_facet_field_spies(self, facets):
+    def _prepare_facet_field_spies(self, database, facets):
         """
         Returns a list of spies based on the facets
-        used to count frequencies.
+        used to count frequencies in `database`.
+
+        The spies of multi valued fields are `XHMultiValueCountMatchSpy`,
+        whose `spies` are added to the enquire instead of themselves.
         """
         spies = []
+        schema = self._update_cache()
         for facet in facets:
             slot = self.column[facet]
-            spy = xapian.ValueCountMatchSpy(slot)
-            # add attribute "slot" to know which column this spy is targeting.
-            spy.slot = slot
+            if self._multi_value_field(facet):
+                if facet not in schema.multi_value_faceted:
+                    raise FacetingError('The multi valued field "%s" is not in MULTI_VALUE_FACET_FIELDS.' % facet)
+                spy = XHMultiValueCountMatchSpy(database, slot)
+            else:
+                spy = xapian.ValueCountMatchSpy(slot)
+                # add attribute "slot" to know which column this spy is targeting.
+                spy.slot = slot
             spies.append(spy)
         return spies
 
@@ -938,54 +2334,47 @@ class XapianSearchBackend(BaseSearchBackend):
         from a list of spies that observed the enquire.
         """
         facet_dict = {}
+        schema = self.schema
         for spy in spies:
-            field = self.schema[spy.slot]
+            field = schema[spy.slot]
             field_name, field_type = field['field_name'], field['type']
 
+            if isinstance(spy, XHMultiValueCountMatchSpy):
+                counts = {}
+                for facet in spy.values():
+                    value = _from_multi_value(facet.term)
+                    counts[value] = counts.get(value, 0) + facet.termfreq
+                facet_dict[field_name] = list(counts.items())
+                continue
+
+            value_encoding = _field_value_encoding(field_name, self.value_encoding)
             facet_dict[field_name] = []
             for facet in list(spy.values()):
-                facet_dict[field_name].append((_from_xapian_value(facet.term, field_type),
+                facet_dict[field_name].append((_from_xapian_value(facet.term, field_type, value_encoding),
                                                facet.termfreq))
         return facet_dict
 
-    def _do_multivalued_field_facets(self, results, field_facets):
-        """
-        Implements a multivalued field facet on the results.
-
-        This is implemented using brute force - O(N^2) -
-        because Xapian does not have it implemented yet
-        (see http://trac.xapian.org/ticket/199)
-        """
-        facet_dict = {}
-
-        for field in field_facets:
-            facet_list = {}
-            if not self._multi_value_field(field):
-                continue
-
-            for result in results:
-                field_value = getattr(result, field)
-                for item in field_value:  # Facet each item in a MultiValueField
-                    facet_list[item] = facet_list.get(item, 0) + 1
-
-            facet_dict[field] = list(facet_list.items())
-        return facet_dict
-
     @staticmethod
-    def _do_date_facets(results, date_facets):
+    def _do_date_facets(spies, date_facets, value_encoding=LEGACY_VALUE_ENCODING):
         """
         Private method that facets a document by date ranges
 
         Required arguments:
-            `results` -- A list SearchResults to facet
+            `spies` -- The spies that observed the values of the date facet fields
+                       during the match, see `_prepare_facet_field_spies`
             `date_facets` -- A dictionary containing facet parameters:
                 {'field': {'start_date': ..., 'end_date': ...: 'gap_by': '...', 'gap_amount': n}}
                 nb., gap must be one of the following:
                     year|month|day|hour|minute|second
 
+        Optional arguments:
+            `value_encoding` -- The encoding of the values of the fields (default = 1)
+
         For each date facet field in `date_facets`, generates a list
-        of date ranges (from `start_date` to `end_date` by `gap_by`) then
-        iterates through `results` and tallies the count for each date_facet.
+        of date ranges (from `start_date` to `end_date` by `gap_by`) and
+        tallies each distinct value of the field observed by its spy in the
+        latest range that starts before it, so that the counts cover the
+        whole match and not only the returned results.
 
         Returns a dictionary of date facets (fields) containing a list with
         entries for each range and a count of documents matching the range.
@@ -1002,62 +2391,34 @@ class XapianSearchBackend(BaseSearchBackend):
         """
         facet_dict = {}
 
-        for date_facet, facet_params in list(date_facets.items()):
-            gap_type = facet_params.get('gap_by')
-            gap_value = facet_params.get('gap_amount', 1)
-            date_range = facet_params['start_date']
-            facet_list = []
-            while date_range < facet_params['end_date']:
-                facet_list.append((date_range.isoformat(), 0))
-                if gap_type == 'year':
-                    date_range = date_range.replace(
-                        year=date_range.year + int(gap_value)
-                    )
-                elif gap_type == 'month':
-                    if date_range.month + int(gap_value) > 12:
-                        date_range = date_range.replace(
-                            month=((date_range.month + int(gap_value)) % 12),
-                            year=(date_range.year + (date_range.month + int(gap_value)) / 12)
-                        )
-                    else:
-                        date_range = date_range.replace(
-                            month=date_range.month + int(gap_value)
-                        )
-                elif gap_type == 'day':
-                    date_range += datetime.timedelta(days=int(gap_value))
-                elif gap_type == 'hour':
-                    date_range += datetime.timedelta(hours=int(gap_value))
-                elif gap_type == 'minute':
-                    date_range += datetime.timedelta(minutes=int(gap_value))
-                elif gap_type == 'second':
-                    date_range += datetime.timedelta(seconds=int(gap_value))
-
-            facet_list = sorted(facet_list, key=lambda x: x[0], reverse=True)
-
-            for result in results:
-                result_date = getattr(result, date_facet)
-                if result_date:
-                    if not isinstance(result_date, datetime.datetime):
-                        result_date = datetime.datetime(
-                            year=result_date.year,
-                            month=result_date.month,
-                            day=result_date.day,
-                        )
-                    for n, facet_date in enumerate(facet_list):
-                        if result_date > datetime.datetime(*(time.strptime(facet_date[0], '%Y-%m-%dT%H:%M:%S')[0:6])):
-                            facet_list[n] = (facet_list[n][0], (facet_list[n][1] + 1))
-                            break
-
-            facet_dict[date_facet] = facet_list
+        for spy, (date_facet, facet_params) in zip(spies, list(date_facets.items())):
+            date_ranges = _get_date_ranges(facet_params)
+            # the values of date fields, in either encoding, sort like the
+            # dates they represent; they are compared as bytes, like the
+            # values returned by the spies on Python 3.
+            keys = [_term_to_xapian_value(
+                date_range, 'datetime' if isinstance(date_range, datetime.datetime) else 'date', value_encoding
+            ) for date_range in date_ranges]
+            keys = [key.encode('utf-8') if isinstance(key, six.text_type) else key for key in keys]
+
+            counts = [0] * len(keys)
+            for item in spy.values():
+                term = item.term.encode('utf-8') if isinstance(item.term, six.text_type) else item.term
+                n = bisect.bisect_left(keys, term) - 1
+                if n >= 0:
+                    counts[n] += item.termfreq
+
+            facet_list = [(date_range.isoformat(), count) for date_range, count in zip(date_ranges, counts)]
+            facet_dict[date_facet] = sorted(facet_list, key=lambda x: x[0], reverse=True)
 
         return facet_dict
 
-    def _do_query_facets(self, results, query_facets):
+    def _do_query_facets(self, query, query_facets):
         """
         Private method that facets a document by query
 
         Required arguments:
-            `results` -- A list SearchResults to facet
+            `query` -- The query of the search, which each facet query narrows
             `query_facets` -- A dictionary containing facet parameters:
                 {'field': 'query', [...]}
 
@@ -1065,16 +2426,77 @@ class XapianSearchBackend(BaseSearchBackend):
         the field name as the key and a tuple with the query and result count
         as the value.
 
+        The facets are only counted (no document is loaded) and, when there
+        are several of them, concurrently by `QUERY_FACET_THREADS` threads.
+
         eg. {'name': ('a*', 5)}
         """
-        facet_dict = {}
-        for field, query in list(dict(query_facets).items()):
-            facet_dict[field] = (query, self.search(self.parse_query(query))['hits'])
+        query_facets = list(dict(query_facets).items())
+
+        # Xapian objects can not be shared between threads, so each
+        # thread reads its own database and a copy of the query.
+        serialised_query = None
+        if len(query_facets) > 1 and self.query_facet_threads > 1 and self.path != MEMORY_DB_NAME:
+            try:
+                serialised_query = query.serialise()
+            except AttributeError:  # Xapian < 1.4
+                pass
+
+        if serialised_query is None:
+            database = self._database()
+            counts = [self._count_query_facet(database, query, facet_query)
+                      for field, facet_query in query_facets]
+        else:
+            def count(facet_query):
+                return self._count_query_facet(self._database(), xapian.Query.unserialise(serialised_query),
+                                               facet_query)
+            counts = self._get_query_facet_pool().map(count, [facet_query for field, facet_query in query_facets])
 
+        facet_dict = {}
+        for (field, facet_query), count in zip(query_facets, counts):
+            facet_dict[field] = (facet_query, count)
         return facet_dict
 
-    @staticmethod
-    def _do_spelling_suggestion(database, query, spelling_query):
+    def _count_query_facet(self, database, query, facet_query):
+        """
+        Returns the number of documents of `database` matching both `query`
+        and the query string `facet_query`, see `HIT_COUNT_MODE`.
+        """
+        enquire = xapian.Enquire(database)
+        enquire.set_query(xapian.Query(xapian.Query.OP_AND, query, self.parse_query(facet_query)))
+        # documents are not ranked, only counted
+        enquire.set_weighting_scheme(xapian.BoolWeight())
+        matches = self._get_enquire_mset(database, enquire, 0, 0, self._get_check_at_least(database))
+        return self._get_hit_count(matches)
+
+    def _get_query_facet_pool(self):
+        """
+        Returns the pool of `QUERY_FACET_THREADS` threads counting query
+        facets, creating it if needed. The pool is shared by all backends
+        with the same number of threads and lives as long as the process.
+        """
+        with _query_facet_pools_lock:
+            pool = _query_facet_pools.get(self.query_facet_threads)
+            if pool is None:
+                pool = multiprocessing.pool.ThreadPool(self.query_facet_threads)
+                _query_facet_pools[self.query_facet_threads] = pool
+        return pool
+
+    def _get_reader_pool(self, staleness):
+        """
+        Returns the `XHReaderPool` of the databases in `PATH` reused for
+        `staleness` seconds, creating it if needed. The pool is shared by
+        all backends with the same path and staleness.
+        """
+        key = (os.path.abspath(self.path), staleness)
+        with _reader_pools_lock:
+            pool = _reader_pools.get(key)
+            if pool is None:
+                pool = XHReaderPool(self.path, staleness)
+                _reader_pools[key] = pool
+        return pool
+
+    def _do_spelling_suggestion(self, database, query, spelling_query):
         """
         Private method that returns a single spelling suggestion based on
         `spelling_query` or `query`.
@@ -1085,42 +2507,209 @@ class XapianSearchBackend(BaseSearchBackend):
             `spelling_query` -- If not None, this will be checked instead of `query`
 
         Returns a string with a suggested spelling
+
+        The suggestions of the words are looked up together, each word once,
+        and cached by database revision in up to `SPELLING_CACHE_SIZE` entries.
         """
         if spelling_query:
-            if ' ' in spelling_query:
-                return ' '.join([database.get_spelling_suggestion(term) for term in spelling_query.split()])
-            else:
-                return database.get_spelling_suggestion(spelling_query)
+            words = spelling_query.split()
+            suggestions = self._get_spelling_suggestions(database, words)
+            return ' '.join([suggestions[word] for word in words])
 
-        term_set = set()
+        words = []
         for term in query:
-            for match in re.findall('[^A-Z]+', term):  # Ignore field identifiers
-                term_set.add(database.get_spelling_suggestion(match))
+            if isinstance(term, six.binary_type):
+                term = term.decode('utf-8')
+            words.extend(re.findall('[^A-Z]+', term))  # Ignore field identifiers
+
+        suggestions = self._get_spelling_suggestions(database, words)
+        suggested = []
+        for word in words:
+            if suggestions[word] not in suggested:
+                suggested.append(suggestions[word])
+        return ' '.join(suggested)
+
+    def _get_spelling_suggestions(self, database, words):
+        """
+        Returns a dictionary with the spelling suggestion of each of `words`.
+        """
+        cache = self.spelling_cache
+        if cache is not None and self.path == MEMORY_DB_NAME:
+            cache = None
+        if cache is not None:
+            version = _get_version(database)
+            if version is None:
+                cache = None
+
+        suggestions = {}
+        for word in words:
+            if word in suggestions:
+                continue
+            suggestion = None
+            if cache is not None:
+                suggestion = cache.get(version + (word,))
+            if suggestion is None:
+                suggestion = database.get_spelling_suggestion(word)
+                if cache is not None:
+                    cache.set(version + (word,), suggestion)
+            suggestions[word] = suggestion
+        return suggestions
+
+    def _database(self, writable=False, staging=False):
+        """
+        Private method that returns a xapian.Database for use.
+
+        Optional arguments:
+            ``writable`` -- Open the database in read/write mode (default=False)
+            ``staging`` -- Open the existing staging database started by `clear`
+                           instead, when `writable` (default=False)
+
+        Returns an instance of a xapian.Database or xapian.WritableDatabase
+
+        Read-only databases come from the `reader_pool` of the backend and
+        must not be closed. Their `VALUE_ENCODING` is checked once per
+        revision, see `_check_value_encoding`.
+        """
+        if self.path == MEMORY_DB_NAME:
+            if not self.inmemory_db:
+                self.inmemory_db = xapian.inmemory_open()
+            return self.inmemory_db
+        if writable and staging:
+            database = xapian.WritableDatabase(self._staging_path(), xapian.DB_OPEN)
+        elif writable:
+            database = xapian.WritableDatabase(self.path, xapian.DB_CREATE_OR_OPEN)
+        else:
+            database = self.reader_pool.get()
+            checked = _get_version(database)
+            if checked is not None:
+                checked += (self.value_encoding,)
+            if checked is None or self._value_encoding_checked != checked:
+                self._check_value_encoding(database, writable=False)
+                self._value_encoding_checked = checked
+
+        return database
+
+    def _check_value_encoding(self, database, writable=True):
+        """
+        Private method that raises InvalidIndexError if `database` was
+        built with another encoding than `VALUE_ENCODING` and, if `writable`,
+        records `VALUE_ENCODING` in its metadata.
+
+        Databases without the metadata were built before it existed,
+        with `LEGACY_VALUE_ENCODING`, unless they are empty.
+        """
+        if self.path == MEMORY_DB_NAME:
+            # only ever written by this backend
+            return
+        stored = database.get_metadata(VALUE_ENCODING_METADATA_KEY)
+        if stored:
+            value_encoding = int(stored)
+        elif database.get_doccount():
+            value_encoding = LEGACY_VALUE_ENCODING
+        else:
+            value_encoding = self.value_encoding
+
+        if value_encoding != self.value_encoding:
+            raise InvalidIndexError('The index in "%s" stores values with encoding %d, not with the '
+                                    '\'VALUE_ENCODING\' %d; clear and rebuild it.'
+                                    % (self.path, value_encoding, self.value_encoding))
+        if writable and not stored:
+            database.set_metadata(VALUE_ENCODING_METADATA_KEY, str(value_encoding))
+
+    def _staging_path(self):
+        """
+        Private method that returns the path of the staging database
+        used when `STAGED_REBUILD` is set.
+        """
+        return '%s.staging' % os.path.abspath(self.path)
 
-        return ' '.join(term_set)
+    def _sibling_path(self, kind):
+        """
+        Private method that creates a new, empty directory next to `PATH`
+        (and thus on the same file system) and returns its path.
 
-    def _database(self, writable=False):
+        Required arguments:
+            `kind` -- A word identifying what the directory is used for
+        """
+        parent, name = os.path.split(os.path.abspath(self.path))
+        return tempfile.mkdtemp(prefix='%s.%s-' % (name, kind), dir=parent)
+
+    @staticmethod
+    def _compact(sources, destination):
         """
-        Private method that returns a xapian.Database for use.
+        Private method that merges the databases in `sources` into a new
+        compacted database in `destination`.
 
-        Optional arguments:
-            ``writable`` -- Open the database in read/write mode (default=False)
+        Required arguments:
+            `sources` -- A list of paths of the databases to merge
+            `destination` -- The path of the merged database
+        """
+        if not sources:
+            xapian.WritableDatabase(destination, xapian.DB_CREATE_OR_OPEN).close()
+        elif hasattr(xapian.Database, 'compact'):
+            # Xapian >= 1.3 replaced `Compactor.compact` by `Database.compact`.
+            database = xapian.Database()
+            for source in sources:
+                database.add_database(xapian.Database(source))
+            database.compact(destination, getattr(xapian, 'DBCOMPACT_MULTIPASS', 0))
+            database.close()
+        else:
+            compactor = xapian.Compactor()
+            for source in sources:
+                compactor.add_source(source)
+            compactor.set_destdir(destination)
+            compactor.compact()
+
+    def _publish(self, new_path):
+        """
+        Private method that replaces the database in `PATH` by the database
+        in `new_path`, a directory next to `PATH`.
+
+        `PATH` becomes a symbolic link to `new_path`, so that it can be
+        atomically swapped by a rename: readers see either the old or the
+        new database. Before the first swap `PATH` may still be a plain
+        directory, which a rename can not replace: it is moved aside right
+        before the link takes its place, so a reader opening the database
+        between the two renames finds none and raises `InvalidIndexError`.
+        On systems without symbolic links, the directory itself is moved to
+        `PATH` in the same way on every swap.
+        """
+        path = os.path.abspath(self.path)
+        old_path = None
+
+        if hasattr(os, 'symlink'):
+            link = '%s.link-%s' % (new_path, os.getpid())
+            os.symlink(os.path.basename(new_path), link)
+            if os.path.islink(path):
+                old_path = os.path.realpath(path)
+            elif os.path.exists(path):
+                old_path = self._sibling_path('old')
+                os.rmdir(old_path)
+                os.rename(path, old_path)
+            os.rename(link, path)
+        else:
+            if os.path.exists(path):
+                old_path = self._sibling_path('old')
+                os.rmdir(old_path)
+                os.rename(path, old_path)
+            os.rename(new_path, path)
 
-        Returns an instance of a xapian.Database or xapian.WritableDatabase
+        self.reader_pool.replaced()
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    @staticmethod
+    def _remove_directory(path):
         """
-        if self.path == MEMORY_DB_NAME:
-            if not self.inmemory_db:
-                self.inmemory_db = xapian.inmemory_open()
-            return self.inmemory_db
-        if writable:
-            database = xapian.WritableDatabase(self.path, xapian.DB_CREATE_OR_OPEN)
+        Private method that removes the database directory `path`, which
+        may be a symbolic link created by `_publish`.
+        """
+        if os.path.islink(path):
+            target = os.path.realpath(path)
+            os.unlink(path)
+            shutil.rmtree(target)
         else:
-            try:
-                database = xapian.Database(self.path)
-            except xapian.DatabaseOpeningError:
-                raise InvalidIndexError('Unable to open index at %s' % self.path)
-
-        return database
+            shutil.rmtree(path)
 
     @staticmethod
     def _get_enquire_mset(database, enquire, start_offset, end_offset, checkatleast=DEFAULT_CHECK_AT_LEAST):
@@ -1160,18 +2749,35 @@ class XapianSearchBackend(BaseSearchBackend):
             database.reopen()
             return document.get_data()
 
-    def _get_hit_count(self, database, enquire):
+    def _get_check_at_least(self, database, mode=None):
         """
-        Given a database and enquire instance, returns the estimated number
-        of matches.
+        Returns the minimum number of documents a match must check
+        so that hit counts are computed according to `HIT_COUNT_MODE`.
 
         Required arguments:
             `database` -- The database to be queried
-            `enquire` -- The enquire instance
+
+        Optional arguments:
+            `mode` -- One of `HIT_COUNT_MODES` to use instead of `HIT_COUNT_MODE`
+        """
+        if (mode or self.hit_count_mode) == 'exact':
+            return database.get_doccount()
+        return self.hit_count_check_at_least
+
+    def _get_hit_count(self, matches, mode=None):
+        """
+        Given the mset of a search, returns the number of matches
+        according to `HIT_COUNT_MODE`.
+
+        Required arguments:
+            `matches` -- The mset, computed with `_get_check_at_least`
+
+        Optional arguments:
+            `mode` -- One of `HIT_COUNT_MODES` to use instead of `HIT_COUNT_MODE`
         """
-        return self._get_enquire_mset(
-            database, enquire, 0, database.get_doccount()
-        ).size()
+        if (mode or self.hit_count_mode) == 'bounded':
+            return matches.get_matches_lower_bound()
+        return matches.get_matches_estimated()
 
     def _multi_value_field(self, field):
         """
@@ -1183,10 +2789,133 @@ class XapianSearchBackend(BaseSearchBackend):
 
         Returns a boolean value indicating whether the field is multi-valued.
         """
-        for field_dict in self.schema:
-            if field_dict['field_name'] == field:
-                return field_dict['multi_valued'] == 'true'
-        return False
+        return field in self._update_cache().multi_valued
+
+
+def _get_version(database):
+    """
+    Returns a tuple with the UUID and the revision of `database`, which
+    changes with every commit, or None on versions of Xapian without
+    `Database.get_revision`: nothing else identifies in-place changes,
+    so the caches keyed by the version are then disabled.
+    """
+    try:
+        revision = database.get_revision()
+    except AttributeError:
+        return None
+    return _get_uuid(database), revision
+
+
+def _get_date_ranges(facet_params):
+    """
+    Returns the list of dates that start each range of a date facet,
+    from `start_date` to `end_date` by `gap_amount` `gap_by`.
+    """
+    gap_type = facet_params.get('gap_by')
+    gap_value = int(facet_params.get('gap_amount', 1))
+    date_range = facet_params['start_date']
+    date_ranges = []
+    while date_range < facet_params['end_date']:
+        date_ranges.append(date_range)
+        if gap_type == 'year':
+            date_range = date_range.replace(year=date_range.year + gap_value)
+        elif gap_type == 'month':
+            year, month = divmod(date_range.month - 1 + gap_value, 12)
+            date_range = date_range.replace(year=date_range.year + year, month=month + 1)
+        elif gap_type == 'day':
+            date_range += datetime.timedelta(days=gap_value)
+        elif gap_type == 'hour':
+            date_range += datetime.timedelta(hours=gap_value)
+        elif gap_type == 'minute':
+            date_range += datetime.timedelta(minutes=gap_value)
+        elif gap_type == 'second':
+            date_range += datetime.timedelta(seconds=gap_value)
+        else:
+            raise FacetingError('Unknown gap_by "%s"' % gap_type)
+    return date_ranges
+
+
+def _get_uuid(database):
+    """
+    Returns the UUID of `database`, which changes when it is recreated,
+    or an empty string on versions of Xapian without `Database.get_uuid`.
+    """
+    try:
+        return database.get_uuid()
+    except AttributeError:
+        return ''
+
+
+def _freeze(value):
+    """
+    Returns `value` with its dictionaries, sets and lists converted
+    to sorted tuples, so that its `repr` is stable.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    elif isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(item) for item in value))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    elif isinstance(value, type):
+        return '%s.%s' % (value.__module__, value.__name__)
+    return value
+
+
+def _get_django_cache(alias):
+    """
+    Returns the Django cache `alias`.
+    """
+    try:
+        from django.core.cache import caches
+    except ImportError:
+        from django.core.cache import get_cache
+        return get_cache(alias)
+    return caches[alias]
+
+
+# the database connections inherited by a worker of `parallel_rebuild`
+_inherited_db_connections = []
+
+
+def _init_shard_worker():
+    """
+    Initialises a worker process of `XapianSearchBackend.parallel_rebuild`.
+
+    The parent closes its connections to database servers before forking,
+    except those inside a transaction: the ones left are set aside, neither
+    used nor closed, since closing them would also end the sessions of the
+    parent, and the worker opens its own. SQLite connections are kept, as
+    an in-memory database only exists in them.
+    """
+    for connection in db_connections.all():
+        if connection.vendor != 'sqlite' and connection.connection is not None:
+            _inherited_db_connections.append(connection.connection)
+            connection.connection = None
+
+
+def _update_shard(task):
+    """
+    Indexes a primary key range of a queryset into a shard database.
+
+    It runs in the worker processes of `XapianSearchBackend.parallel_rebuild`,
+    which passes `task` as a tuple
+    (backend_class, connection_alias, path, model, query, (first_pk, next_pk)):
+    the range starts at `first_pk` and ends before `next_pk`, if not None.
+    """
+    backend_class, connection_alias, path, model, query, (first_pk, next_pk) = task
+
+    connection = connections[connection_alias]
+    options = dict(connection.options, PATH=path)
+    backend = backend_class(connection_alias, **options)
+    index = connection.get_unified_index().get_index(model)
+
+    queryset = model._default_manager.all()
+    queryset.query = query
+    queryset = queryset.filter(pk__gte=first_pk)
+    if next_pk is not None:
+        queryset = queryset.filter(pk__lt=next_pk)
+    backend.update(index, queryset.iterator())
 
 
 class XapianSearchQuery(BaseSearchQuery):
@@ -1195,30 +2924,55 @@ class XapianSearchQuery(BaseSearchQuery):
     It acts as an intermediary between the ``SearchQuerySet`` and the
     ``SearchBackend`` itself.
     """
+    def __init__(self, *args, **kwargs):
+        super(XapianSearchQuery, self).__init__(*args, **kwargs)
+        # whether the last built query has no text part, see `build_query`
+        self._boolean_query = False
+
     def build_params(self, *args, **kwargs):
         kwargs = super(XapianSearchQuery, self).build_params(*args, **kwargs)
 
         if self.end_offset is not None:
             kwargs['end_offset'] = self.end_offset - self.start_offset
 
+        if self._boolean_query:
+            kwargs['boolean_query'] = True
+
         return kwargs
 
+    def get_count(self):
+        """
+        Returns the number of results of the query.
+
+        Unless the results were already fetched, it only counts the
+        matches (see `XapianSearchBackend.count`), without loading them.
+        """
+        if self._hit_count is None and not self._more_like_this and not getattr(self, '_raw_query', None):
+            self._hit_count = self.backend.count(self.build_query(), **self.build_params())
+        return super(XapianSearchQuery, self).get_count()
+
     def build_query(self):
+        """
+        Returns the Xapian::Query of the filters of this query.
+
+        Filters that only restrict the matches (see `FILTER_TYPES`) and the
+        models are combined with OP_FILTER, so that they do not contribute
+        weights. If there is nothing but such filters, the backend is told
+        to not rank the results (see `build_params`).
+        """
         if not self.query_filter:
             query = xapian.Query('')
+            is_filter = True
         else:
-            query = self._query_from_search_node(self.query_filter)
+            query, is_filter = self._query_from_search_node(self.query_filter)
 
         if self.models:
             subqueries = [
-                xapian.Query(
-                    xapian.Query.OP_SCALE_WEIGHT,
-                    xapian.Query('%s%s' % (TERM_PREFIXES['django_ct'], get_model_ct(model))),
-                    0  # Pure boolean sub-query
-                ) for model in self.models
+                xapian.Query('%s%s' % (TERM_PREFIXES['django_ct'], get_model_ct(model)))
+                for model in self.models
             ]
             query = xapian.Query(
-                xapian.Query.OP_AND, query,
+                xapian.Query.OP_FILTER, query,
                 xapian.Query(xapian.Query.OP_OR, subqueries)
             )
 
@@ -1233,28 +2987,56 @@ class XapianSearchQuery(BaseSearchQuery):
                 xapian.Query.OP_AND_MAYBE, query,
                 xapian.Query(xapian.Query.OP_OR, subqueries)
             )
+            is_filter = False
 
+        self._boolean_query = is_filter
         return query
 
     def _query_from_search_node(self, search_node, is_not=False):
-        query_list = []
+        """
+        Returns a tuple (query, is_filter) with the query of `search_node`
+        and whether it only restricts the matches.
+
+        The filters of an AND node are combined with OP_FILTER; an OR node
+        is a filter only if all its children are.
+        """
+        kinds = []
 
         for child in search_node.children:
             if isinstance(child, SearchNode):
-                query_list.append(
-                    self._query_from_search_node(child, child.negated)
-                )
+                kinds.append(self._query_from_search_node(child, child.negated))
             else:
                 expression, term = child
                 field_name, filter_type = search_node.split_expression(expression)
 
-                constructed_query_list = self._query_from_term(term, field_name, filter_type, is_not)
-                query_list.extend(constructed_query_list)
+                is_filter = self._is_filter(term, field_name, filter_type)
+                for query in self._query_from_term(term, field_name, filter_type, is_not):
+                    kinds.append((query, is_filter))
+
+        query_list = [query for query, is_filter in kinds if not is_filter]
+        filter_list = [query for query, is_filter in kinds if is_filter]
 
         if search_node.connector == 'OR':
-            return xapian.Query(xapian.Query.OP_OR, query_list)
+            return xapian.Query(xapian.Query.OP_OR, [query for query, _ in kinds]), not query_list
+        elif not query_list:
+            return xapian.Query(xapian.Query.OP_AND, filter_list), True
+        elif not filter_list:
+            return xapian.Query(xapian.Query.OP_AND, query_list), False
         else:
-            return xapian.Query(xapian.Query.OP_AND, query_list)
+            return xapian.Query(
+                xapian.Query.OP_FILTER,
+                xapian.Query(xapian.Query.OP_AND, query_list),
+                xapian.Query(xapian.Query.OP_AND, filter_list)
+            ), False
+
+    @staticmethod
+    def _is_filter(term, field_name, filter_type):
+        """
+        Returns whether the query of `term` on `field_name` only restricts the matches.
+        """
+        if isinstance(term, AutoQuery) or field_name == 'content':
+            return False
+        return filter_type in FILTER_TYPES or field_name in ('id', 'django_id', 'django_ct')
 
     def _query_from_term(self, term, field_name, filter_type, is_not):
         """
@@ -1297,7 +3079,7 @@ class XapianSearchQuery(BaseSearchQuery):
                 filter_type = None
         else:
             # get the field_type from the backend
-            field_type = self.backend.schema[self.backend.column[field_name]]['type']
+            field_type = self.backend._update_cache().types[field_name]
 
         # private fields don't accept 'contains' or 'startswith'
         # since they have no meaning.
@@ -1367,15 +3149,28 @@ class XapianSearchQuery(BaseSearchQuery):
         Because OP_AND_NOT(C, D) <=> (C and ~D), then D=(A in {B,C}) requires `is_not=False`.
 
         Assumes term is a list.
-        """
-        query_list = [self._filter_exact(term, field_name, field_type, is_not=False)
-                      for term in term_list]
+
+        On fields matched by a single term (see `_boolean_term`), e.g.
+        `django_id`, the query is one flat OR of the distinct terms,
+        which stays cheap for lists of thousands of values.
+        """
+        if self._has_boolean_terms(field_name):
+            terms = []
+            seen = set()
+            for term in term_list:
+                term = self._boolean_term(term, field_name, field_type)
+                if term not in seen:
+                    seen.add(term)
+                    terms.append(term)
+            query = xapian.Query(xapian.Query.OP_OR, terms)
+        else:
+            query = xapian.Query(xapian.Query.OP_OR, [self._filter_exact(term, field_name, field_type, is_not=False)
+                                                      for term in term_list])
 
         if is_not:
-            return xapian.Query(xapian.Query.OP_AND_NOT, self._all_query(),
-                                xapian.Query(xapian.Query.OP_OR, query_list))
+            return xapian.Query(xapian.Query.OP_AND_NOT, self._all_query(), query)
         else:
-            return xapian.Query(xapian.Query.OP_OR, query_list)
+            return query
 
     def _filter_exact(self, term, field_name, field_type, is_not):
         """
@@ -1383,8 +3178,13 @@ class XapianSearchQuery(BaseSearchQuery):
         with positional order.
 
         Assumes term is not a list.
+
+        On private fields and fields of `EXACT_FIELDS`,
+        matches their single term instead (see `_boolean_term`).
         """
-        if field_type == 'text':
+        if self._has_boolean_terms(field_name):
+            query = xapian.Query(self._boolean_term(term, field_name, field_type))
+        elif field_type == 'text':
             term = '^ %s $' % term
             query = self._phrase_query(term.split(), field_name, field_type)
         else:
@@ -1395,13 +3195,74 @@ class XapianSearchQuery(BaseSearchQuery):
         else:
             return query
 
+    def _has_boolean_terms(self, field_name):
+        """
+        Returns whether each value of `field_name` is indexed as a single term.
+        """
+        return field_name in ('id', 'django_id', 'django_ct') or \
+            field_name in self.backend._update_cache().exact
+
+    def _boolean_term(self, term, field_name, field_type):
+        """
+        Returns the term of the value `term` of `field_name`, a private
+        field or a field of `EXACT_FIELDS`.
+        """
+        if field_name in ('id', 'django_id', 'django_ct'):
+            # to ensure the value is serialized correctly.
+            if field_name == 'django_id':
+                term = int(term)
+            else:
+                term = _to_xapian_term(term)
+            return '%s%s' % (TERM_PREFIXES[field_name], _term_to_xapian_value(term, field_type))
+        return _exact_term(TERM_PREFIXES['field'] + field_name.upper(), term)
+
     def _filter_startswith(self, term, field_name, field_type, is_not):
         """
         Returns a startswith query on the un-stemmed term.
 
         Assumes term is not a list.
-        """
-        if field_type == 'text':
+
+        On fields of `PREFIX_FIELDS`, prefixes of up to `PREFIX_MAX_LENGTH`
+        characters match a single term. On fields of `EXACT_FIELDS`, which
+        have no "^" term, the exact terms starting with the value match
+        (values whose exact term is a sha1 can not). Otherwise, on
+        Xapian >= 1.4, single words are expanded (without parsing a query)
+        to at most `WILDCARD_EXPANSION_LIMIT` terms which, on text fields,
+        must follow the "^" term marking the beginning of the field. A word
+        that the indexer splits in several terms (e.g. 'david-h') matches
+        the phrase of its terms, the last of them expanded.
+        """
+        prefix = TERM_PREFIXES['field'] + field_name.upper() if field_name else ''
+        value = _normalize_value(term)
+        wildcard_terms = None
+        if hasattr(xapian.Query, 'OP_WILDCARD') and len(value.split()) == 1:
+            wildcard_terms = _split_terms(value)
+
+        if field_name in self.backend._update_cache().prefix_indexed and \
+                0 < len(value) <= self.backend.prefix_max_length:
+            query = xapian.Query(_prefix_term(prefix, value))
+        elif field_name in self.backend._update_cache().exact:
+            term = _exact_term(prefix, value)
+            if hasattr(xapian.Query, 'OP_WILDCARD'):
+                query = xapian.Query(xapian.Query.OP_WILDCARD, term,
+                                     self.backend.wildcard_expansion_limit or 0,
+                                     self.backend._get_wildcard_limit_type())
+            else:
+                query = xapian.Query(xapian.Query.OP_OR,
+                                     [item.term for item in self.backend._database().allterms(term)])
+        elif wildcard_terms:
+            queries = [xapian.Query(prefix + term) for term in wildcard_terms[:-1]]
+            queries.append(xapian.Query(xapian.Query.OP_WILDCARD, prefix + wildcard_terms[-1],
+                                        self.backend.wildcard_expansion_limit or 0,
+                                        self.backend._get_wildcard_limit_type()))
+            if field_type == 'text':
+                # other words of the field may start with the value too
+                queries.insert(0, xapian.Query(prefix + '^'))
+            if len(queries) == 1:
+                query = queries[0]
+            else:
+                query = xapian.Query(xapian.Query.OP_PHRASE, queries, len(queries))
+        elif field_type == 'text':
             if len(term.split()) == 1:
                 term = '^ %s*' % term
                 query = self.backend.parse_query(term)
@@ -1453,11 +3314,7 @@ class XapianSearchQuery(BaseSearchQuery):
             term = _to_xapian_term(term)
 
         if field_name in ('id', 'django_id', 'django_ct'):
-            # to ensure the value is serialized correctly.
-            if field_name == 'django_id':
-                term = int(term)
-            term = _term_to_xapian_value(term, field_type)
-            return xapian.Query('%s%s' % (TERM_PREFIXES[field_name], term))
+            return xapian.Query(self._boolean_term(term, field_name, field_type))
 
         # we construct the query dates in a slightly different way
         if field_type == 'datetime':
@@ -1494,34 +3351,319 @@ class XapianSearchQuery(BaseSearchQuery):
         Private method that returns a xapian.Query that searches for any term
         that is greater than `term` in a specified `field`.
         """
-        vrp = XHValueRangeProcessor(self.backend)
-        pos, begin, end = vrp('%s:%s' % (field_name, _term_to_xapian_value(term, field_type)), '*')
+        if self._is_sortable(field_name, field_type):
+            query = xapian.Query(xapian.Query.OP_VALUE_GE, self.backend.column[field_name],
+                                 _term_to_xapian_value(term, field_type, SORTABLE_VALUE_ENCODING))
+        else:
+            vrp = XHValueRangeProcessor(self.backend)
+            pos, begin, end = vrp('%s:%s' % (field_name, _term_to_xapian_value(term, field_type)), '*')
+            query = xapian.Query(xapian.Query.OP_VALUE_RANGE, pos, begin, end)
         if is_not:
-            return xapian.Query(xapian.Query.OP_AND_NOT,
-                                self._all_query(),
-                                xapian.Query(xapian.Query.OP_VALUE_RANGE, pos, begin, end)
-                                )
-        return xapian.Query(xapian.Query.OP_VALUE_RANGE, pos, begin, end)
+            return xapian.Query(xapian.Query.OP_AND_NOT, self._all_query(), query)
+        return query
 
     def _filter_lte(self, term, field_name, field_type, is_not):
         """
         Private method that returns a xapian.Query that searches for any term
         that is less than `term` in a specified `field`.
         """
-        vrp = XHValueRangeProcessor(self.backend)
-        pos, begin, end = vrp('%s:' % field_name, '%s' % _term_to_xapian_value(term, field_type))
+        if self._is_sortable(field_name, field_type):
+            query = xapian.Query(xapian.Query.OP_VALUE_LE, self.backend.column[field_name],
+                                 _term_to_xapian_value(term, field_type, SORTABLE_VALUE_ENCODING))
+        else:
+            vrp = XHValueRangeProcessor(self.backend)
+            pos, begin, end = vrp('%s:' % field_name, '%s' % _term_to_xapian_value(term, field_type))
+            query = xapian.Query(xapian.Query.OP_VALUE_RANGE, pos, begin, end)
         if is_not:
-            return xapian.Query(xapian.Query.OP_AND_NOT,
-                                self._all_query(),
-                                xapian.Query(xapian.Query.OP_VALUE_RANGE, pos, begin, end)
-                                )
-        return xapian.Query(xapian.Query.OP_VALUE_RANGE, pos, begin, end)
+            return xapian.Query(xapian.Query.OP_AND_NOT, self._all_query(), query)
+        return query
+
+    def _is_sortable(self, field_name, field_type):
+        """
+        Returns whether the values of `field_name` of `field_type` are stored
+        with `xapian.sortable_serialise`, so that an open range on them
+        does not need the smallest or largest value as its other bound.
+        """
+        return _field_value_encoding(field_name, self.backend.value_encoding) == SORTABLE_VALUE_ENCODING and \
+            field_type in ('integer', 'date', 'datetime')
+
+
+def _add_text(document, term_generator, termpos, text, weight, prefix='', markers=True):
+    """
+    indexes text appending 2 extra terms
+    to identify beginning and ending of the text,
+    unless `markers` is False.
+    """
+    term_generator.set_termpos(termpos)
 
+    if markers:
+        # add begin
+        document.add_posting('%s^' % prefix, termpos, weight)
+    # add text
+    term_generator.index_text(text, weight, prefix)
+    termpos = term_generator.get_termpos()
+    if markers:
+        # add ending
+        termpos += 1
+        document.add_posting('%s$' % prefix, termpos, weight)
 
-def _term_to_xapian_value(term, field_type):
+    # increase termpos
+    term_generator.set_termpos(termpos)
+    term_generator.increase_termpos(TERMPOS_DISTANCE)
+
+    return term_generator.get_termpos()
+
+
+def _add_literal_text(document, termpos, text, weight, prefix='', markers=True):
+    """
+    Adds sentence to the document with positional information
+    but without processing.
+
+    The sentence is bounded by "^" "$" to allow exact matches,
+    unless `markers` is False.
+    """
+    if markers:
+        text = '^ %s $' % text
+    for word in text.split():
+        term = '%s%s' % (prefix, word)
+        document.add_posting(term, termpos, weight)
+        termpos += 1
+    termpos += TERMPOS_DISTANCE
+    return termpos
+
+
+def _add_text_terms(document, term_generator, termpos, prefix, text, weight, exact=False):
+    """
+    Adds text to the document with positional information
+    and processing (e.g. stemming).
+
+    Exact matches on fields of `EXACT_FIELDS` (`exact`) use their exact
+    term instead: their text is added without the "^" and "$" terms and
+    the literal text only once, with the prefix of the field.
+    """
+    markers = not exact
+    termpos = _add_text(document, term_generator, termpos, text, weight, prefix=prefix, markers=markers)
+    termpos = _add_text(document, term_generator, termpos, text, weight, prefix='', markers=markers)
+    termpos = _add_literal_text(document, termpos, text, weight, prefix=prefix, markers=markers)
+    if not exact:
+        termpos = _add_literal_text(document, termpos, text, weight, prefix='')
+    return termpos
+
+
+def _ngram_terms(value, min_length=NGRAM_MIN_LENGTH, max_length=NGRAM_MAX_LENGTH):
+    """
+    Returns the set of distinct ngrams of `min_length` to `max_length`
+    characters of the words of `value`.
+    """
+    terms = set()
+    for item in _to_xapian_term(value).split():
+        item_length = len(item)
+        for size in six.moves.range(min_length, min(max_length, item_length) + 1):
+            terms.update(item[start:start + size] for start in six.moves.range(0, item_length - size + 1))
+    return terms
+
+
+def _edge_ngram_terms(value, min_length=NGRAM_MIN_LENGTH, max_length=NGRAM_MAX_LENGTH):
+    """
+    Returns the set of distinct leading ngrams of `min_length` to `max_length`
+    characters of the words of `value`; words shorter than `min_length`
+    are kept whole.
+    """
+    terms = set()
+    for item in _to_xapian_term(value).split():
+        item_length = len(item)
+        for size in six.moves.range(min(min_length, item_length), min(max_length, item_length) + 1):
+            terms.add(item[:size])
+    return terms
+
+
+def _index_private_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                         value_encoding=LEGACY_VALUE_ENCODING):
+    """
+    Adds `id`, `django_id` or `django_ct` to the document as a single
+    term and as a value, which is the term whatever `value_encoding` is
+    (see `_field_value_encoding`).
+    """
+    if prefix == TERM_PREFIXES['django_id']:
+        value = int(value)
+    value = _term_to_xapian_value(value, field_type)
+
+    document.add_term(prefix + value, weight)
+    document.add_value(column, value)
+    return termpos
+
+
+def _index_multi_valued_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                              value_encoding=LEGACY_VALUE_ENCODING, exact=False, faceted=True):
+    """
+    Adds each value of a multi valued field as text, allowing exact matches
+    on each of them, and, if `faceted`, stores the original values in slots
+    of their own for faceting (see `_multi_value_slot` and `_multi_value_to_xapian_value`).
+    """
+    if faceted:
+        for position, item in enumerate(value):
+            if position < MULTI_VALUE_SLOTS:
+                document.add_value(_multi_value_slot(column, position), _multi_value_to_xapian_value(item))
+    for item in value:
+        termpos = _add_text_terms(document, term_generator, termpos, prefix, _to_xapian_term(item), weight, exact)
+    return termpos
+
+
+def _index_text_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                      value_encoding=LEGACY_VALUE_ENCODING, exact=False):
+    """
+    Adds text to the document with positional information.
+    """
+    document.add_value(column, _term_to_xapian_value(value, field_type, value_encoding))
+    term = _to_xapian_term(value)
+    if term == '':
+        return termpos
+    return _add_text_terms(document, term_generator, termpos, prefix, term, weight, exact)
+
+
+def _index_datetime_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                          value_encoding=LEGACY_VALUE_ENCODING):
+    """
+    Adds a datetime to document with positional order
+    to allow exact matches on it.
+    """
+    document.add_value(column, _term_to_xapian_value(value, field_type, value_encoding))
+    term = _to_xapian_term(value)
+    if term == '':
+        return termpos
+
+    date, time = term.split()
+    document.add_posting(date, termpos, weight)
+    termpos += 1
+    document.add_posting(time, termpos, weight)
+    termpos += 1
+    document.add_posting(prefix + date, termpos, weight)
+    termpos += 1
+    document.add_posting(prefix + time, termpos, weight)
+    termpos += TERMPOS_DISTANCE + 1
+    return termpos
+
+
+def _index_ngram_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                       value_encoding=LEGACY_VALUE_ENCODING, ngram_lengths=(NGRAM_MIN_LENGTH, NGRAM_MAX_LENGTH),
+                       unprefixed=True):
+    """
+    Splits the term in ngrams and adds each distinct ngram to the index once.
+    The minimum and maximum size of the ngrams are `ngram_lengths`
+    (see `XHSchema`); the ngrams are also added without prefix if `unprefixed`.
+    """
+    document.add_value(column, _term_to_xapian_value(value, field_type, value_encoding))
+    _add_ngram_terms(document, prefix, _ngram_terms(value, *ngram_lengths), weight, unprefixed)
+    return termpos
+
+
+def _index_edge_ngram_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                            value_encoding=LEGACY_VALUE_ENCODING, ngram_lengths=(NGRAM_MIN_LENGTH, NGRAM_MAX_LENGTH),
+                            unprefixed=True):
+    """
+    Splits the term in edge ngrams and adds each distinct ngram to the index once.
+    The minimum and maximum size of the ngrams are `ngram_lengths`
+    (see `XHSchema`); the ngrams are also added without prefix if `unprefixed`.
+    """
+    document.add_value(column, _term_to_xapian_value(value, field_type, value_encoding))
+    _add_ngram_terms(document, prefix, _edge_ngram_terms(value, *ngram_lengths), weight, unprefixed)
+    return termpos
+
+
+def _add_ngram_terms(document, prefix, terms, weight, unprefixed):
+    """
+    Adds each ngram of `terms` with `prefix` and, if `unprefixed`, without it.
+    """
+    for term in terms:
+        if unprefixed:
+            document.add_term(term, weight)
+        document.add_term(prefix + term, weight)
+
+
+def _index_term_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                      value_encoding=LEGACY_VALUE_ENCODING):
+    """
+    Adds term to the document without positional information
+    and without processing.
+    """
+    document.add_value(column, _term_to_xapian_value(value, field_type, value_encoding))
+    term = _to_xapian_term(value)
+    if term == '':
+        return termpos
+
+    document.add_term(term, weight)
+    document.add_term(prefix + term, weight)
+    return termpos
+
+
+def _index_exact_text_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                            value_encoding=LEGACY_VALUE_ENCODING):
+    """
+    Adds text like `_index_text_field` and its exact term (see `_exact_term`),
+    which replaces the terms of exact phrases (see `_add_text_terms`).
+    """
+    if _to_xapian_term(value) != '':
+        document.add_term(_exact_term(prefix, value), 0)
+    return _index_text_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                             value_encoding, exact=True)
+
+
+def _index_exact_multi_valued_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                                    value_encoding=LEGACY_VALUE_ENCODING, faceted=True):
+    """
+    Adds a multi valued field like `_index_multi_valued_field` and the exact
+    term of each of its values, which replaces the terms of exact phrases.
+    """
+    for item in value:
+        document.add_term(_exact_term(prefix, item), 0)
+    return _index_multi_valued_field(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                                     value_encoding, exact=True, faceted=faceted)
+
+
+def _prefix_indexer(handler, multi_valued, max_length):
+    """
+    Returns a function indexing a field like `handler` that also adds the
+    prefix terms of its values (see `_prefix_terms`).
+    """
+    def index(document, term_generator, termpos, prefix, column, field_type, value, weight,
+              value_encoding=LEGACY_VALUE_ENCODING):
+        for item in (value if multi_valued else [value]):
+            for term in _prefix_terms(prefix, item, max_length):
+                document.add_term(term, 0)
+        return handler(document, term_generator, termpos, prefix, column, field_type, value, weight,
+                       value_encoding)
+    return index
+
+
+# maps the type of a single valued field to the function used to index it;
+# other types are indexed by `_index_term_field`.
+FIELD_INDEXERS = {
+    'text': _index_text_field,
+    'datetime': _index_datetime_field,
+    'ngram': _index_ngram_field,
+    'edge_ngram': _index_edge_ngram_field,
+}
+
+
+def _field_value_encoding(field_name, value_encoding):
+    """
+    Returns the encoding of the values of `field_name` in an index whose
+    `VALUE_ENCODING` is `value_encoding`: the values of the private fields
+    are their terms, so they always use `LEGACY_VALUE_ENCODING`.
+    """
+    if field_name in ('id', 'django_id', 'django_ct'):
+        return LEGACY_VALUE_ENCODING
+    return value_encoding
+
+
+def _term_to_xapian_value(term, field_type, value_encoding=LEGACY_VALUE_ENCODING):
     """
     Converts a term to a serialized
     Xapian value based on the field_type.
+
+    Integers, dates and datetimes are serialized according to
+    `value_encoding` (see `VALUE_ENCODINGS`); terms of the
+    private fields always use `LEGACY_VALUE_ENCODING`.
     """
     assert field_type in FIELD_TYPES
 
@@ -1541,7 +3683,10 @@ def _term_to_xapian_value(term, field_type):
             value = 'f'
 
     elif field_type == 'integer':
-        value = INTEGER_FORMAT % term
+        if value_encoding == SORTABLE_VALUE_ENCODING:
+            value = xapian.sortable_serialise(term)
+        else:
+            value = INTEGER_FORMAT % term
     elif field_type == 'float':
         value = xapian.sortable_serialise(term)
     elif field_type == 'date' or field_type == 'datetime':
@@ -1549,6 +3694,8 @@ def _term_to_xapian_value(term, field_type):
             # http://stackoverflow.com/a/1937636/931303 and comments
             term = datetime.datetime.combine(term, datetime.time())
         value = strf(term)
+        if value_encoding == SORTABLE_VALUE_ENCODING:
+            value = xapian.sortable_serialise(int(value))
     else:  # field_type == 'text'
         value = _to_xapian_term(term)
 
@@ -1563,7 +3710,65 @@ def _to_xapian_term(term):
     return force_text(term).lower()
 
 
-def _from_xapian_value(value, field_type):
+def _split_terms(text):
+    """
+    Returns the terms, in order, in which `xapian.TermGenerator` splits
+    `text` when it indexes it without stemming.
+    """
+    document = xapian.Document()
+    term_generator = xapian.TermGenerator()
+    term_generator.set_document(document)
+    term_generator.index_text(text)
+
+    terms = []
+    for item in document.termlist():
+        term = item.term.decode('utf-8') if isinstance(item.term, six.binary_type) else item.term
+        terms.extend((position, term) for position in item.positer)
+    return [term for position, term in sorted(terms)]
+
+
+def _normalize_value(value):
+    """
+    Returns `value` as a lower case text with single spaces.
+    """
+    return ' '.join(_to_xapian_term(value).split())
+
+
+def _exact_term(prefix, value):
+    """
+    Returns the single term matching exactly `value` in the field whose
+    terms are prefixed by `prefix`, for fields of `EXACT_FIELDS`.
+
+    The value is normalized like the phrases of exact filters (lower case,
+    single spaces) and replaced by its sha1 if the term would be longer
+    than `MAX_TERM_LENGTH`.
+    """
+    prefix = '%s%s:' % (TERM_PREFIXES['exact'], prefix[len(TERM_PREFIXES['field']):])
+    value = _normalize_value(value)
+    term = prefix + value
+    if len(term.encode('utf-8')) > MAX_TERM_LENGTH:
+        term = prefix + hashlib.sha1(value.encode('utf-8')).hexdigest()
+    return term
+
+
+def _prefix_terms(prefix, value, max_length):
+    """
+    Returns the terms of the first 1 to `max_length` characters of `value`
+    (normalized like by `_exact_term`) in the field whose terms are prefixed
+    by `prefix`, for fields of `PREFIX_FIELDS`.
+    """
+    value = _normalize_value(value)
+    return [_prefix_term(prefix, value[:length]) for length in six.moves.range(1, min(len(value), max_length) + 1)]
+
+
+def _prefix_term(prefix, value):
+    """
+    Returns the prefix term of the (normalized) leading characters `value`.
+    """
+    return '%s%s:%s' % (TERM_PREFIXES['prefix'], prefix[len(TERM_PREFIXES['field']):], value)
+
+
+def _from_xapian_value(value, field_type, value_encoding=LEGACY_VALUE_ENCODING):
     """
     Converts a serialized Xapian value
     to Python equivalent based on the field_type.
@@ -1579,10 +3784,14 @@ def _from_xapian_value(value, field_type):
         else:
             InvalidIndexError('Field type "%d" does not accept value "%s"' % (field_type, value))
     elif field_type == 'integer':
+        if value_encoding == SORTABLE_VALUE_ENCODING:
+            return int(xapian.sortable_unserialise(value))
         return int(value)
     elif field_type == 'float':
         return xapian.sortable_unserialise(value)
     elif field_type == 'date' or field_type == 'datetime':
+        if value_encoding == SORTABLE_VALUE_ENCODING:
+            value = '%014d' % xapian.sortable_unserialise(value)
         datetime_value = datetime.datetime.strptime(value, DATETIME_FORMAT)
         if field_type == 'datetime':
             return datetime_value
@@ -1592,6 +3801,239 @@ def _from_xapian_value(value, field_type):
         return value
 
 
+def _multi_value_to_xapian_value(value):
+    """
+    Converts a value of a multi valued field to a text starting with a
+    character identifying its Python type, so that `_from_multi_value`
+    returns it unchanged (e.g. not lower cased) in facets.
+    """
+    if isinstance(value, bool):
+        return 'b' + _term_to_xapian_value(value, 'boolean')
+    elif isinstance(value, six.integer_types):
+        return 'i%d' % value
+    elif isinstance(value, float):
+        return 'f' + repr(value)
+    elif isinstance(value, datetime.datetime):
+        return 't' + _term_to_xapian_value(value, 'datetime')
+    elif isinstance(value, datetime.date):
+        return 'd' + _term_to_xapian_value(value, 'date')
+    return 's' + force_text(value)
+
+
+def _from_multi_value(value):
+    """
+    Converts a text returned by `_multi_value_to_xapian_value`
+    back to the value of the multi valued field.
+    """
+    kind, value = value[:1], value[1:]
+    if kind == 'b':
+        return _from_xapian_value(value, 'boolean')
+    elif kind == 'i':
+        return int(value)
+    elif kind == 'f':
+        return float(value)
+    elif kind == 't':
+        return _from_xapian_value(value, 'datetime')
+    elif kind == 'd':
+        return _from_xapian_value(value, 'date')
+    return value
+
+
+def _multi_value_slot(column, position):
+    """
+    Returns the value slot of the value at `position` of
+    the multi valued field of `column`.
+    """
+    return MULTI_VALUE_SLOT_START + column * MULTI_VALUE_SLOTS + position
+
+
+def _decode_stored_data(data, fields=None, get_field_names=None):
+    """
+    Decodes the data of a document written by `XHPickleCodec` or `XHCompactCodec`.
+
+    Returns a tuple (app_label, model_name, pk, fields); if `fields` is not
+    empty, the values of other fields are not decoded. `get_field_names`
+    returns the `stored_field_names` of the schema of a fingerprint, or
+    None; it is required by the data of `XHCompactCodec` written with a schema.
+    """
+    if not data or bytearray(data[:1])[0] not in COMPACT_CODEC_VERSIONS:
+        return pickle.loads(data)
+    version = bytearray(data[:1])[0]
+
+    compression = bytearray(data[1:2])[0]
+    payload = data[2:]
+    if compression == COMPRESSIONS['zlib']:
+        payload = zlib.decompress(payload)
+    elif compression == COMPRESSIONS['lz4']:
+        payload = _import_lz4().decompress(payload)
+    payload = bytearray(payload)
+
+    app_label, position = _decode_stored_value(payload, 0)
+    model_name, position = _decode_stored_value(payload, position)
+    pk, position = _decode_stored_value(payload, position)
+
+    field_names = None
+    if version >= 2:
+        fingerprint, position = _decode_varint(payload, position)
+        if fingerprint:
+            field_names = get_field_names(fingerprint) if get_field_names is not None else None
+            if field_names is None:
+                raise InvalidIndexError('The stored fields of the schema %08x are unknown.' % fingerprint)
+
+    model_data = {}
+    count, position = _decode_varint(payload, position)
+    for i in six.moves.range(count):
+        number = 0
+        if version >= 2:
+            number, position = _decode_varint(payload, position)
+        if number:
+            field_name = field_names[number - 1]
+        else:
+            field_name, position = _decode_stored_value(payload, position)
+        length, position = _decode_varint(payload, position)
+        if not fields or field_name in fields:
+            model_data[field_name] = _decode_stored_value(payload, position)[0]
+        position += length
+
+    return app_label, model_name, pk, model_data
+
+
+def _fingerprint(field_names):
+    """
+    Returns a 32 bits number identifying the sequence `field_names`, never 0.
+    """
+    digest = hashlib.sha1('\n'.join(field_names).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) or 1
+
+
+def _encode_varint(buffer, number):
+    """
+    Appends the non-negative integer `number` to the bytearray `buffer`,
+    7 bits per byte.
+    """
+    while number > 0x7f:
+        buffer.append((number & 0x7f) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def _decode_varint(buffer, position):
+    """
+    Returns the integer encoded by `_encode_varint` at `position`
+    of `buffer` and the position that follows it.
+    """
+    number = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+def _encode_stored_value(buffer, value):
+    """
+    Appends `value` to the bytearray `buffer` as a type tag followed by
+    its encoding. Values of other types than None, booleans, integers,
+    floats, strings, dates, datetimes, lists and tuples are pickled.
+    """
+    if value is None:
+        buffer += b'N'
+    elif value is True:
+        buffer += b'T'
+    elif value is False:
+        buffer += b'F'
+    elif isinstance(value, six.integer_types):
+        buffer += b'i'
+        _encode_varint(buffer, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        buffer += b'f'
+        buffer += struct.pack('>d', value)
+    elif isinstance(value, six.text_type):
+        buffer += b's'
+        value = value.encode('utf-8')
+        _encode_varint(buffer, len(value))
+        buffer += value
+    elif isinstance(value, six.binary_type):
+        buffer += b'b'
+        _encode_varint(buffer, len(value))
+        buffer += value
+    elif isinstance(value, datetime.datetime) and value.tzinfo is None:
+        buffer += b'D'
+        buffer += struct.pack('>HBBBBBI', value.year, value.month, value.day,
+                              value.hour, value.minute, value.second, value.microsecond)
+    elif type(value) is datetime.date:
+        buffer += b'd'
+        buffer += struct.pack('>HBB', value.year, value.month, value.day)
+    elif isinstance(value, (list, tuple)):
+        buffer += b'l' if isinstance(value, list) else b'u'
+        _encode_varint(buffer, len(value))
+        for item in value:
+            _encode_stored_value(buffer, item)
+    else:
+        buffer += b'p'
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        _encode_varint(buffer, len(value))
+        buffer += value
+
+
+def _decode_stored_value(buffer, position):
+    """
+    Returns the value encoded by `_encode_stored_value` at `position`
+    of `buffer` and the position that follows it.
+    """
+    tag = buffer[position:position + 1]
+    position += 1
+
+    if tag == b'N':
+        return None, position
+    elif tag == b'T':
+        return True, position
+    elif tag == b'F':
+        return False, position
+    elif tag == b'i':
+        number, position = _decode_varint(buffer, position)
+        return (number >> 1) if not number & 1 else -((number + 1) >> 1), position
+    elif tag == b'f':
+        return struct.unpack('>d', bytes(buffer[position:position + 8]))[0], position + 8
+    elif tag in (b's', b'b', b'p'):
+        length, position = _decode_varint(buffer, position)
+        value = bytes(buffer[position:position + length])
+        if tag == b's':
+            value = value.decode('utf-8')
+        elif tag == b'p':
+            value = pickle.loads(value)
+        return value, position + length
+    elif tag == b'D':
+        fields = struct.unpack('>HBBBBBI', bytes(buffer[position:position + 11]))
+        return datetime.datetime(*fields), position + 11
+    elif tag == b'd':
+        fields = struct.unpack('>HBB', bytes(buffer[position:position + 4]))
+        return datetime.date(*fields), position + 4
+    elif tag in (b'l', b'u'):
+        length, position = _decode_varint(buffer, position)
+        items = []
+        for i in six.moves.range(length):
+            item, position = _decode_stored_value(buffer, position)
+            items.append(item)
+        return (items if tag == b'l' else tuple(items)), position
+    raise InvalidIndexError('Unknown type of stored value "%r"' % tag)
+
+
+def _import_lz4():
+    """
+    Returns the `lz4.block` module used by `XHCompactCodec`.
+    """
+    try:
+        import lz4.block
+    except ImportError:
+        raise MissingDependency("The 'lz4' compression of the 'xapian' backend requires "
+                                "the installation of 'lz4'.")
+    return lz4.block
+
+
 class XapianEngine(BaseEngine):
     backend = XapianSearchBackend
     query = XapianSearchQuery